@@ -0,0 +1,451 @@
+# async_client.py
+"""
+asyncio client for the LAN chat server, for driving many chat sessions from
+one process (load tests, relays for several users) without a thread per session.
+
+It speaks HTTP/1.1 over non-blocking sockets with the standard library only,
+so it runs without the vendored libs. Sessions share one ConnectionPool:
+
+    pool = ConnectionPool("192.168.1.10", 5000, max_connections=50)
+    chat = AsyncChatClient(pool)
+    await chat.new_session()
+    print(await chat.chat("What is a linked list?"))
+    async for token in chat.stream("Explain recursion."):
+        print(token, end="")
+    await chat.reset()
+    await pool.close()
+
+Run it directly for a quick load test:
+
+    python async_client.py 192.168.1.10 --sessions 200 --turns 3 --stream
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Use orjson for decoding replies if it happens to be installed; it takes the raw bytes directly
+try:
+    from orjson import loads, dumps
+except ImportError:
+    import json
+    from json import loads
+
+    def dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+SERVER_PORT = 5000
+# Pooled connections idle for longer than this are closed rather than reused; shorter than
+# the server's keep-alive timeout (SERVER_KEEPALIVE, 15s by default), as in client.py
+IDLE_TIMEOUT = float(os.environ.get("CLIENT_IDLE_TIMEOUT", "10"))
+MAX_HEADER_LINES = 100
+# Throttled (429) and overloaded (503) replies are retried once their Retry-After has
+# passed, for up to this many seconds per request, as client.py's batch mode does
+RETRY_STATUSES = (429, 503)
+RETRY_DEADLINE = float(os.environ.get("CLIENT_RETRY_DEADLINE", "300"))
+
+
+class ChatError(Exception):
+    """The server answered with an error status, or an error event in a stream."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return loads(self.body)
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+        self.reused = False
+
+    def usable(self):
+        return (not self.reader.at_eof() and not self.writer.is_closing()
+                and time.monotonic() - self.last_used <= IDLE_TIMEOUT)
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool:
+    """
+    Kept-alive HTTP/1.1 connections to one server, shared by any number of
+    clients. At most `max_connections` are open at once; requests beyond that
+    wait for a connection to be released.
+    """
+
+    def __init__(self, host, port=SERVER_PORT, max_connections=100, connect_timeout=10):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self._slots = asyncio.Semaphore(max_connections)
+        self._idle = []
+        self.stats = {"opened": 0, "reused": 0}
+
+    async def acquire(self):
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                conn = self._idle.pop()
+                if conn.usable():
+                    conn.reused = True
+                    self.stats["reused"] += 1
+                    return conn
+                conn.close()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.connect_timeout)
+            self.stats["opened"] += 1
+            return _Connection(reader, writer)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, reusable):
+        """Returns a connection to the pool, or closes it if the response didn't leave it reusable."""
+        if reusable:
+            conn.last_used = time.monotonic()
+            # Most recently used last, so acquire() picks the warmest connection
+            self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        for conn in idle:
+            try:
+                await conn.writer.wait_closed()
+            except OSError:
+                pass
+
+    def _encode_request(self, method, path, body, headers):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                 "Accept-Encoding: identity", "Connection: keep-alive"]
+        if body is not None:
+            lines += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+
+    async def _send(self, method, path, body, headers):
+        """
+        Sends a request and reads the status line and headers. Returns (conn, status, headers).
+
+        A kept-alive connection the server closed while it sat idle fails before any
+        response arrives; the request is then resent once on a new connection.
+        """
+        while True:
+            conn = await self.acquire()
+            try:
+                conn.writer.write(self._encode_request(method, path, body, headers))
+                await conn.writer.drain()
+                status, response_headers = await _read_head(conn.reader)
+                return conn, status, response_headers
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                self.release(conn, False)
+                if not conn.reused:
+                    raise ConnectionError(f"Connection to {self.host}:{self.port} failed: {e}") from e
+            except BaseException:
+                self.release(conn, False)
+                raise
+
+    async def request(self, method, path, body=None, headers=None, timeout=90):
+        """Sends a request and reads the whole response."""
+        async def run():
+            conn, status, response_headers = await self._send(method, path, body, headers)
+            reusable = False
+            try:
+                chunks = [chunk async for chunk in _read_body(conn.reader, response_headers)]
+                reusable = _keeps_alive(response_headers)
+            finally:
+                self.release(conn, reusable)
+            return Response(status, response_headers, b"".join(chunks))
+        return await asyncio.wait_for(run(), timeout)
+
+    async def stream_lines(self, method, path, body=None, headers=None, timeout=90):
+        """
+        Sends a request and yields the response body line by line (without line endings).
+        Raises ChatError for a non-200 response. `timeout` applies to each line.
+        """
+        conn, status, response_headers = await asyncio.wait_for(
+            self._send(method, path, body, headers), timeout)
+        reusable = False
+        try:
+            if status != 200:
+                chunks = [chunk async for chunk in _read_body(conn.reader, response_headers)]
+                reusable = _keeps_alive(response_headers)
+                raise _error_from(status, response_headers, b"".join(chunks))
+            pending = b""
+            body_chunks = _read_body(conn.reader, response_headers).__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(body_chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                pending += chunk
+                *lines, pending = pending.split(b"\n")
+                for line in lines:
+                    yield line.rstrip(b"\r")
+            if pending:
+                yield pending.rstrip(b"\r")
+            reusable = _keeps_alive(response_headers)
+        finally:
+            # A stream abandoned half way leaves unread data on the connection, so it isn't reused
+            self.release(conn, reusable)
+
+
+async def _read_head(reader):
+    status_line = await reader.readuntil(b"\r\n")
+    version, status, _ = status_line.decode("latin-1").split(" ", 2)
+    headers = {":version": version}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            return int(status), headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    raise ConnectionError("Too many response headers")
+
+
+async def _read_body(reader, headers):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+            if size == 0:
+                # Skip trailers up to the final blank line
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return
+            yield await reader.readexactly(size)
+            await reader.readexactly(2)
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining:
+            chunk = await reader.read(min(remaining, 65536))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            remaining -= len(chunk)
+            yield chunk
+    else:
+        # No framing (e.g. an HTTP/1.0 server): the body runs until the server closes the connection
+        while chunk := await reader.read(65536):
+            yield chunk
+
+
+def _keeps_alive(headers):
+    connection = headers.get("connection", "").lower()
+    if headers[":version"] == "HTTP/1.0":
+        return connection == "keep-alive" and "content-length" in headers
+    return connection != "close" and ("content-length" in headers or "transfer-encoding" in headers)
+
+
+def _error_from(status, headers, body):
+    try:
+        message = loads(body).get("error")
+    except (ValueError, AttributeError):
+        message = None
+    try:
+        retry_after = float(headers["retry-after"])
+    except (KeyError, ValueError):
+        retry_after = None
+    return ChatError(message or f"HTTP {status}", status=status, retry_after=retry_after)
+
+
+class AsyncChatClient:
+    """
+    One chat session, with the same /chat, /chat/stream and /reset_chat
+    semantics as client.py. Any number of these can share a ConnectionPool.
+
+    Requests the server throttles or sheds are sent again after its Retry-After,
+    until `retry_deadline` seconds have passed; `throttled` and `waited` count
+    how often and how long this session was held back.
+    """
+
+    def __init__(self, pool, timeout=90, retry_deadline=RETRY_DEADLINE):
+        self.pool = pool
+        self.timeout = timeout
+        self.retry_deadline = retry_deadline
+        self.headers = {}
+        self.throttled = 0
+        self.waited = 0.0
+
+    async def _backoff(self, error, deadline):
+        """Sleeps as a retryable error's Retry-After asks; returns False if it can't be retried in time."""
+        if error.status not in RETRY_STATUSES:
+            return False
+        wait = error.retry_after if error.retry_after is not None else 1.0
+        if time.monotonic() + wait > deadline:
+            return False
+        self.throttled += 1
+        self.waited += wait
+        await asyncio.sleep(wait)
+        return True
+
+    async def _post(self, path, payload=None):
+        body = dumps(payload) if payload is not None else None
+        deadline = time.monotonic() + self.retry_deadline
+        while True:
+            response = await self.pool.request("POST", path, body, self.headers, self.timeout)
+            if response.status == 200:
+                return response.json()
+            error = _error_from(response.status, response.headers, response.body)
+            if not await self._backoff(error, deadline):
+                raise error
+
+    async def new_session(self):
+        """Asks the server for a session token identifying this conversation."""
+        self.headers = {}
+        data = await self._post("/session")
+        self.headers = {"X-Session-Token": data["session_token"]}
+
+    async def chat(self, prompt, stateless=False):
+        """Sends a prompt to /chat and returns the whole reply."""
+        payload = {"prompt": prompt, "stateless": True} if stateless else {"prompt": prompt}
+        return (await self._post("/chat", payload))["response"]
+
+    async def reset(self):
+        """Clears this session's history on the server and returns its message."""
+        return (await self._post("/reset_chat")).get("message", "Chat reset.")
+
+    async def stream(self, prompt, stateless=False):
+        """Sends a prompt to /chat/stream and yields the reply's tokens as they arrive."""
+        payload = {"prompt": prompt, "stateless": True} if stateless else {"prompt": prompt}
+        deadline = time.monotonic() + self.retry_deadline
+        while True:
+            started = False
+            try:
+                async for token in self._stream_once(dumps(payload)):
+                    started = True
+                    yield token
+                return
+            except ChatError as e:
+                # Only a refused request is sent again, never a reply that had already begun
+                if started or not await self._backoff(e, deadline):
+                    raise
+
+    async def _stream_once(self, body):
+        event = None
+        lines = self.pool.stream_lines("POST", "/chat/stream", body, self.headers, self.timeout)
+        try:
+            async for line in lines:
+                if not line:
+                    # A blank line ends the current server-sent event
+                    event = None
+                elif line.startswith(b"event:"):
+                    event = line[len(b"event:"):].strip().decode("utf-8")
+                elif line.startswith(b"data:"):
+                    data = loads(line[len(b"data:"):])
+                    if event == "error":
+                        raise ChatError(data.get("error") or "Stream error")
+                    if event == "done":
+                        # Read on to the end of the response, so the connection can be reused
+                        continue
+                    yield data.get("token", "")
+        finally:
+            await lines.aclose()
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_load(host, port, sessions, turns, connections, stream, prompt):
+    """
+    Runs `sessions` concurrent conversations of `turns` turns each. Returns (latencies,
+    errors, pool stats, throttling): throttling counts the sessions the server held back
+    with Retry-After and the seconds they waited, which aren't errors in themselves.
+    """
+    pool = ConnectionPool(host, port, max_connections=connections)
+    latencies = []
+    errors = {}
+    throttling = {"sessions": 0, "waited": 0.0}
+
+    async def talk(chat, index):
+        try:
+            await chat.new_session()
+        except (ChatError, ConnectionError, OSError, asyncio.TimeoutError) as e:
+            key = getattr(e, "status", None) or type(e).__name__
+            errors[key] = errors.get(key, 0) + 1
+            return
+        for turn in range(turns):
+            text = f"{prompt} (session {index}, turn {turn + 1})"
+            started, waited = time.perf_counter(), chat.waited
+            try:
+                if stream:
+                    async for _ in chat.stream(text):
+                        pass
+                else:
+                    await chat.chat(text)
+            except (ChatError, ConnectionError, OSError, asyncio.TimeoutError) as e:
+                key = getattr(e, "status", None) or type(e).__name__
+                errors[key] = errors.get(key, 0) + 1
+                continue
+            # Time spent waiting out Retry-After isn't the server's latency
+            latencies.append(time.perf_counter() - started - (chat.waited - waited))
+
+    async def conversation(index):
+        chat = AsyncChatClient(pool)
+        try:
+            await talk(chat, index)
+        finally:
+            if chat.throttled:
+                throttling["sessions"] += 1
+                throttling["waited"] += chat.waited
+
+    try:
+        await asyncio.gather(*(conversation(i) for i in range(sessions)))
+    finally:
+        await pool.close()
+    return sorted(latencies), errors, dict(pool.stats), throttling
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drives many concurrent chat sessions from one process.")
+    parser.add_argument("server_ip", help="Server IP address")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--sessions", type=int, default=100, help="Concurrent chat sessions (default 100)")
+    parser.add_argument("--turns", type=int, default=3, help="Prompts per session (default 3)")
+    parser.add_argument("--connections", type=int, default=100,
+                        help="Most connections open to the server at once (default 100)")
+    parser.add_argument("--stream", action="store_true", help="Use /chat/stream instead of /chat")
+    parser.add_argument("--prompt", default="Explain recursion with an example.")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    latencies, errors, pool_stats, throttling = asyncio.run(run_load(
+        args.server_ip, args.port, args.sessions, args.turns, args.connections, args.stream, args.prompt))
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(latencies)} turns in {elapsed:.1f}s ({len(latencies) / elapsed:.1f} turns/s) "
+          f"over {pool_stats['opened']} connections ({pool_stats['reused']} reuses)")
+    if latencies:
+        print("Latency ms: " + "  ".join(f"p{pct} {percentile(latencies, pct) * 1000:.1f}"
+                                         for pct in (50, 95, 99)))
+    if throttling["sessions"]:
+        print(f"Throttled: {throttling['sessions']} of {args.sessions} sessions waited "
+              f"{throttling['waited']:.1f}s in total for the server's Retry-After")
+    if errors:
+        print("Errors: " + ", ".join(f"{key}: {count}" for key, count in sorted(errors.items(), key=str)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ SETLOCAL
 REM --- Define paths relative to the script's location ---
 REM %~dp0 is the drive and path of the batch file itself, always ending with a backslash.
 SET "LIBS_DIR=%~dp0libs"
+SET "LIBS_ZIP=%~dp0libs.zip"
 SET "CLIENT_SCRIPT=%~dp0client.py"
 SET "BUNDLE_FILENAME=%~dp0requests_bundle.zip"
 SET "IP_CACHE_FILE=%~dp0.server_ip_cache"
@@ -13,9 +14,9 @@ REM Go to the script's directory to ensure relative paths work consistently
 pushd "%~dp0"
 
 REM --- Main Logic ---
-REM Check if the libs directory exists. If not, run setup.
-IF NOT EXIST "%LIBS_DIR%\" (
-    ECHO %LIBS_DIR% not found. Running first-time setup...
+REM Check if the libraries are installed (libs.zip, or a libs directory from an older setup). If not, run setup.
+IF NOT EXIST "%LIBS_ZIP%" IF NOT EXIST "%LIBS_DIR%\" (
+    ECHO %LIBS_ZIP% not found. Running first-time setup...
     CALL :run_setup
     REM Check the return code from the setup subroutine
     IF %ERRORLEVEL% NEQ 0 (
@@ -27,7 +28,7 @@ IF NOT EXIST "%LIBS_DIR%\" (
 
 REM Get the cached server IP
 IF NOT EXIST "%IP_CACHE_FILE%" (
-    ECHO Server IP not configured. Please run the setup again by deleting the 'libs' folder.
+    ECHO Server IP not configured. Please run the setup again by deleting 'libs.zip'.
     popd
     EXIT /B 1
 ) ELSE (
@@ -58,53 +59,60 @@ REM --- Subroutine for First-Time Setup ---
 
     ECHO %SERVER_IP% > "%IP_CACHE_FILE%"
 
-    SET "BUNDLE_URL=http://%SERVER_IP%:5000/download_dependencies"
-    ECHO Downloading from %SERVER_IP%...
+    REM Only this machine's libraries are downloaded; names match j.py's TARGET_PLATFORMS
+    SET "PLATFORM="
+    FOR /F "usebackq delims=" %%P IN (`python -c "import platform; m = platform.machine().lower(); print('windows_amd64' if m in ['x86_64', 'amd64'] else '')"`) DO SET "PLATFORM=%%P"
+    SET "BUNDLE_KIND=%PLATFORM%"
+    REM j.py builds no other Windows platform (e.g. ARM64). Those machines use the x64 libraries
+    REM from the universal bundle; make_libs_zip leaves out compiled modules, so they run as pure Python.
+    IF "%PLATFORM%"=="" (
+        ECHO No libraries are built for this architecture, using the universal bundle's windows_amd64 ones.
+        SET "PLATFORM=windows_amd64"
+        SET "BUNDLE_KIND=universal"
+    )
+
+    SET "BUNDLE_URL=http://%SERVER_IP%:5000/download_dependencies/%PLATFORM%"
+    IF "%BUNDLE_KIND%"=="universal" SET "BUNDLE_URL=http://%SERVER_IP%:5000/download_dependencies"
+    SET "HTTP_CODE_FILE=%~dp0.download_status"
+    ECHO Downloading %PLATFORM% libraries from %SERVER_IP%...
     REM Curl is generally available on modern Windows versions
-    curl -# -L -f -o "%BUNDLE_FILENAME%" "%BUNDLE_URL%"
-    
-    IF %ERRORLEVEL% NEQ 0 (
-        ECHO ERROR: Download failed. Check server IP and connection.
+    REM -C - resumes a partial download left by an earlier, interrupted run
+    curl -# -L -f -C - -o "%BUNDLE_FILENAME%" -w "%%{http_code}" "%BUNDLE_URL%" > "%HTTP_CODE_FILE%"
+    SET "CURL_STATUS=%ERRORLEVEL%"
+    SET "HTTP_CODE="
+    SET /P HTTP_CODE=<"%HTTP_CODE_FILE%"
+    DEL "%HTTP_CODE_FILE%" 2>NUL
+    REM -f fails on any HTTP error; only 416 is expected, when the earlier run had already got the whole file
+    IF "%CURL_STATUS%"=="22" IF NOT "%HTTP_CODE%"=="416" (
+        ECHO ERROR: The server refused the download, HTTP status %HTTP_CODE%. Check server IP, or ask whether it has libraries for %PLATFORM%.
+        EXIT /B 1
+    )
+    IF NOT "%CURL_STATUS%"=="0" IF NOT "%CURL_STATUS%"=="22" IF NOT "%CURL_STATUS%"=="33" (
+        ECHO ERROR: Download interrupted. Check server IP and connection, then run this script again to resume.
         EXIT /B 1
     )
 
-    ECHO Unpacking libraries...
-    REM Use python to perform platform-aware unzipping
-    REM Paths passed to python must be valid Windows paths and
-    REM correctly quoted within the Python string. Using raw strings r'' is best.
-    
-    REM Define paths for the Python script
-    REM Use %~dp0 directly for dynamic path resolution inside the -c command if needed
-    REM For clarity, explicitly set them here
-    SET "PY_LIBS_DIR=%LIBS_DIR%"
-    SET "PY_BUNDLE_FILENAME=%BUNDLE_FILENAME%"
-    SET "PY_TEMP_EXTRACT_PATH=%~dp0temp_bundle_extract"
+    CALL :verify_bundle
+    IF %ERRORLEVEL% NEQ 0 (
+        REM The partial file was from an older bundle, or the server refused the range; start over
+        ECHO Bundle is incomplete or out of date, downloading it again...
+        DEL "%BUNDLE_FILENAME%" 2>NUL
+        curl -# -L -f -o "%BUNDLE_FILENAME%" "%BUNDLE_URL%"
+        IF ERRORLEVEL 1 (
+            ECHO ERROR: Download failed. Check server IP and connection.
+            EXIT /B 1
+        )
+        CALL :verify_bundle
+        IF ERRORLEVEL 1 (
+            ECHO ERROR: Downloaded bundle does not match the server's checksum.
+            DEL "%BUNDLE_FILENAME%" 2>NUL
+            EXIT /B 1
+        )
+    )
 
-    python -c "import os, sys, platform, zipfile, shutil; \
-    LIBS_DIR = r'%PY_LIBS_DIR%'; \
-    BUNDLE_FILENAME = r'%PY_BUNDLE_FILENAME%'; \
-    TEMP_EXTRACT_PATH = r'%PY_TEMP_EXTRACT_PATH%'; \
-    \
-    def get_platform_identifier(): \
-        s, m = platform.system().lower(), platform.machine().lower(); \
-        if s == 'linux': return 'linux_x86_64' if m in ['x86_64', 'amd64'] else 'linux_aarch64'; \
-        if s == 'darwin': return 'macos_arm64' if m == 'arm64' else 'macos_x86_64'; \
-        if s == 'windows': \
-            if m in ['x86_64', 'amd64']: return 'windows_x86_64'; \
-            elif m == 'arm64': return 'windows_arm64'; \
-            else: return None; \
-        return None; \
-    \
-    p_dir = get_platform_identifier(); \
-    if not p_dir: sys.exit(f'FATAL: Unsupported OS/Architecture ({platform.system()}/{platform.machine()})'); \
-    \
-    with zipfile.ZipFile(BUNDLE_FILENAME, 'r') as zf: zf.extractall(TEMP_EXTRACT_PATH); \
-    source_dir = os.path.join(TEMP_EXTRACT_PATH, p_dir); \
-    if not os.path.exists(source_dir): sys.exit(f'FATAL: Bundle missing files for {p_dir}.'); \
-    \
-    shutil.copytree(source_dir, LIBS_DIR); \
-    shutil.rmtree(TEMP_EXTRACT_PATH);"
-    
+    ECHO Packing libraries...
+    REM One zip with precompiled modules that client.py imports from directly, instead of extracting the bundle
+    python "%~dp0make_libs_zip.py" "%BUNDLE_FILENAME%" "%PLATFORM%" "%LIBS_ZIP%"
     IF %ERRORLEVEL% NEQ 0 (
         ECHO ERROR: Failed to set up libraries.
         DEL "%BUNDLE_FILENAME%" 2>NUL
@@ -112,4 +120,10 @@ REM --- Subroutine for First-Time Setup ---
     )
     DEL "%BUNDLE_FILENAME%" 2>NUL
     ECHO --- Setup complete! ---
-    EXIT /B 0
\ No newline at end of file
+    EXIT /B 0
+
+REM --- Subroutine: check the downloaded bundle against the SHA-256 in the server's manifest ---
+REM (skipped if the server doesn't publish one)
+:verify_bundle
+    python "%~dp0verify_bundle.py" "%BUNDLE_FILENAME%" "%BUNDLE_KIND%" "%SERVER_IP%"
+    EXIT /B %ERRORLEVEL%
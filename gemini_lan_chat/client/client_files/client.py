@@ -1,53 +1,469 @@
+import argparse
 import sys
 import os
-# We leave 'json' out for now as it will be imported later with the others.
+import time
+# requests and friends are only imported on the first network call (see load_requests)
 
 # --- Robust Dependency Check ---
 # Get the absolute path of the directory where this script is located
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-# Define the libs directory path relative to the script's location
+# Define the libs paths relative to the script's location. The setup scripts write
+# libs.zip (imported straight from the archive); older installs have a libs directory.
+LIBS_ZIP = os.path.join(SCRIPT_DIR, "libs.zip")
 LIBS_DIR = os.path.join(SCRIPT_DIR, "libs")
 
-# Check if the libs directory exists
-if not os.path.isdir(LIBS_DIR):
-    print(f"ERROR: The '{LIBS_DIR}' directory was not found.")
+if os.path.isfile(LIBS_ZIP):
+    LIBS_PATH = LIBS_ZIP
+elif os.path.isdir(LIBS_DIR):
+    LIBS_PATH = LIBS_DIR
+else:
+    print(f"ERROR: Neither '{LIBS_ZIP}' nor the '{LIBS_DIR}' directory was found.")
     print("Please run 'start_client.sh' or 'start_client.bat' to install dependencies.")
     sys.exit(1)
 
-# Add the libs directory to the Python path. THIS IS THE CRITICAL STEP.
-sys.path.insert(0, LIBS_DIR)
+# Add the libs to the Python path. THIS IS THE CRITICAL STEP.
+sys.path.insert(0, LIBS_PATH)
 # --- End Dependency Check ---
 
 
-# --- NOW it is safe to import everything from the libs folder ---
-try:
+# requests, urllib3 and what they pull in (ssl, http.cookiejar, charset_normalizer,
+# idna, certifi, ...) make up most of the start-up time, so they are imported on
+# the first network call instead of here.
+requests = None
+
+
+def load_requests():
+    """Imports requests from the libs on first use and returns the module."""
+    global requests
+    if requests is not None:
+        return requests
+    try:
+        import warnings
+        import urllib3
+        import requests as requests_module
+        # Suppress the specific OpenSSL warning, as it's not an error for this app
+        warnings.filterwarnings("ignore", category=urllib3.exceptions.NotOpenSSLWarning)
+    except ImportError as e:
+        # This will catch if any of the libraries are missing
+        print(f"ERROR: A required library is missing: {e}")
+        print(f"'{LIBS_PATH}' might be corrupted. Please delete it and run the start script again.")
+        sys.exit(1)
+    requests = requests_module
+    return requests
+
+
+def loads(data):
+    """Decodes a JSON reply. The decoder is only imported on first use, like requests."""
+    global loads
+    # Use orjson if it happens to be installed; it takes the raw bytes directly
+    try:
+        from orjson import loads as decode
+    except ImportError:
+        from json import loads as decode
+    loads = decode
+    return decode(data)
+
+
+SERVER_PORT = 5000
+# Connections kept open to the server; one is enough for the interactive client
+POOL_SIZE = int(os.environ.get("CLIENT_POOL_SIZE", "4"))
+# Kept-alive connections idle for longer than this are dropped before the next request.
+# It should be shorter than the server's keep-alive timeout (SERVER_KEEPALIVE, 15s by default),
+# so a turn never goes out on a socket the server is just closing.
+IDLE_TIMEOUT = float(os.environ.get("CLIENT_IDLE_TIMEOUT", "10"))
+# Batch mode sends prompts to /chat/batch this many at a time (the server accepts up to its
+# BATCH_MAX_PROMPTS, 64 by default). A full rate-limit bucket lets a whole chunk through at once.
+BATCH_CHUNK_SIZE = int(os.environ.get("CLIENT_BATCH_CHUNK_SIZE", "64"))
+# Prompts the server throttled (429) or shed (503) are sent again once its Retry-After has
+# passed, for as long as it takes, up to this many seconds into the run
+BATCH_DEADLINE = float(os.environ.get("CLIENT_BATCH_DEADLINE", "600"))
+
+
+class KeepAliveSession:
+    """
+    One requests.Session shared by every turn, so turns reuse a kept-alive
+    connection instead of opening a new one each time. The session (and
+    requests itself) is only created by the first request.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, idle_timeout=IDLE_TIMEOUT):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.session = None
+        self._last_used = time.monotonic()
+
+    def _open(self):
+        load_requests()
+        from urllib3.util.retry import Retry
+        session = requests.Session()
+        # Only failed connection attempts are retried; a POST that reached the server is never resent
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size,
+            max_retries=Retry(total=2, connect=2, read=0, status=0, redirect=0,
+                              backoff_factor=0.2, raise_on_status=False))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        if self.session is None:
+            self.session = self._open()
+        elif time.monotonic() - self._last_used > self.idle_timeout:
+            # The server has probably closed the idle connection; start a fresh one instead of
+            # failing the request on a dead socket
+            self.session.close()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            self.touch()
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def touch(self):
+        """Marks the connection as used just now, e.g. after reading a streamed response to the end."""
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+
+def new_session(http, session_endpoint):
+    """Asks the server for a session token identifying this client's conversation."""
+    response = http.post(session_endpoint, timeout=10)
+    response.raise_for_status()
+    return {"X-Session-Token": loads(response.content)["session_token"]}
+
+
+def stream_chat(http, chat_endpoint, prompt, headers):
+    """Sends a prompt to the streaming endpoint and prints tokens as they arrive."""
+    with http.post(chat_endpoint, json={"prompt": prompt}, headers=headers, stream=True, timeout=90) as response:
+        response.raise_for_status()
+        _print_stream(response)
+    http.touch()
+
+
+def _print_stream(response):
+    event = None
+    print("Gemini: ", end="", flush=True)
+    for line in response.iter_lines():
+        if not line:
+            # A blank line ends the current server-sent event
+            event = None
+            continue
+        if line.startswith(b"event:"):
+            event = line[len(b"event:"):].strip().decode("utf-8")
+        elif line.startswith(b"data:"):
+            data = loads(line[len(b"data:"):])
+            if event == "error":
+                print(f"\nServer Error: {data.get('error')}")
+                return
+            if event == "done":
+                break
+            print(data.get("token", ""), end="", flush=True)
+    print()
+
+
+def read_batch(lines):
+    """
+    Parses JSONL batch input: one {"prompt": ..., "id": ...} object (id is optional)
+    or one JSON string per line. Blank lines are skipped. Yields (id, prompt, error).
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            item = loads(line)
+        except ValueError as e:
+            yield None, None, f"Invalid JSON: {e}"
+            continue
+        if isinstance(item, str):
+            item = {"prompt": item}
+        if not isinstance(item, dict) or not isinstance(item.get("prompt"), str) or not item["prompt"]:
+            yield item.get("id") if isinstance(item, dict) else None, None, "Missing 'prompt'"
+            continue
+        yield item.get("id"), item["prompt"], None
+
+
+def _error_message(response):
+    try:
+        return loads(response.content).get("error") or f"HTTP {response.status_code}"
+    except (ValueError, AttributeError):
+        return f"HTTP {response.status_code}"
+
+
+def _retry_after(value):
+    try:
+        return max(float(value), 0.1)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class Backoff:
+    """
+    Pause shared by every request of a batch run: once the server asks for a break with
+    Retry-After, no request goes out until it is over, and none after the deadline.
+    """
+
+    def __init__(self, deadline):
+        import threading
+        self._lock = threading.Lock()
+        self._deadline = time.monotonic() + deadline
+        self._until = 0.0
+        self.waited = 0.0
+
+    def pause(self, seconds):
+        with self._lock:
+            now = time.monotonic()
+            until = max(self._until, now + seconds)
+            # Wall-clock time spent paused, however many requests sit out the same pause
+            self.waited += until - max(self._until, now)
+            self._until = until
+
+    def wait(self):
+        """Sleeps until the pause is over; returns False if it would outlast the deadline."""
+        while True:
+            with self._lock:
+                delay = self._until - time.monotonic()
+                if delay <= 0:
+                    return True
+                if self._until > self._deadline:
+                    return False
+            time.sleep(delay)
+
+
+def ask_batch(http, batch_endpoint, prompts, backoff):
+    """
+    Answers a chunk of prompts through /chat/batch without conversation history and returns
+    one {"response"} or {"error"} dict per prompt, in order. Throttled (429) and overloaded (503)
+    replies, and prompts the server answered with a retry_after, are sent again once the wait
+    is over; only when the backoff's deadline passes first do they become errors.
+    """
+    results = [None] * len(prompts)
+    last_errors = {}
+    pending = list(range(len(prompts)))
+    while pending:
+        if not backoff.wait():
+            for i in pending:
+                results[i] = {"error": f"Gave up waiting for the server: {last_errors[i]}"}
+            break
+        started = time.perf_counter()
+        with http.post(batch_endpoint, json={"prompts": [prompts[i] for i in pending], "stateless": True,
+                                             "stream": True}, stream=True, timeout=90) as response:
+            if response.status_code in (429, 503):
+                backoff.pause(_retry_after(response.headers.get("Retry-After")))
+                last_errors.update(dict.fromkeys(pending, _error_message(response)))
+                continue
+            if response.status_code != 200:
+                raise requests.HTTPError(_error_message(response), response=response)
+            retry = []
+            # One line per prompt as soon as it is answered, indexed within this request
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                item = loads(line)
+                i = pending[item.pop("index")]
+                if "retry_after" in item:
+                    backoff.pause(_retry_after(item.pop("retry_after")))
+                    last_errors[i] = item["error"]
+                    retry.append(i)
+                    continue
+                item["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                results[i] = item
+        http.touch()
+        pending = sorted(retry)
+    return results
+
+
+def run_batch(server_ip, source, output, parallel):
+    """
+    Answers every prompt in the JSONL `source` through /chat/batch, BATCH_CHUNK_SIZE
+    prompts per request with up to `parallel` requests in flight, and writes one JSON line
+    per prompt to `output`, in input order: {"index", "id", "response" or "error", "latency_ms"}.
+    Waiting out the server's rate limit doesn't count as an error. Returns the number of errors.
+    """
     import json
-    import warnings
-    import urllib3
-    import requests
-    # Suppress the specific OpenSSL warning, as it's not an error for this app
-    warnings.filterwarnings("ignore", category=urllib3.exceptions.NotOpenSSLWarning)
-except ImportError as e:
-    # This will catch if any of the libraries are missing
-    print(f"ERROR: A required library is missing: {e}")
-    print(f"The 'libs' directory might be corrupted. Please delete it and run the start script again.")
-    sys.exit(1)
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import islice
+
+    load_requests()
+    batch_endpoint = f"http://{server_ip}:{SERVER_PORT}/chat/batch"
+    http = KeepAliveSession(pool_size=parallel)
+    backoff = Backoff(BATCH_DEADLINE)
+
+    def answer(chunk):
+        results = []
+        for index, (item_id, prompt, error) in chunk:
+            result = {"index": index}
+            if item_id is not None:
+                result["id"] = item_id
+            if error is not None:
+                result["error"] = error
+            results.append(result)
+        asked = [(result, prompt) for result, (_, (_, prompt, error)) in zip(results, chunk) if error is None]
+        if not asked:
+            return results
+        try:
+            answers = ask_batch(http, batch_endpoint, [prompt for _, prompt in asked], backoff)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            answers = [{"error": str(e)}] * len(asked)
+        for (result, _), answer in zip(asked, answers):
+            result.update(answer)
+        return results
+
+    numbered = enumerate(read_batch(source))
+    chunks = iter(lambda: list(islice(numbered, BATCH_CHUNK_SIZE)), [])
+    count = errors = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        # map() yields in input order, each chunk as soon as it and all before it are done
+        for results in executor.map(answer, chunks):
+            for result in results:
+                count += 1
+                errors += "error" in result
+                output.write(json.dumps(result) + "\n")
+            output.flush()
+    http.close()
+    waited = f", {backoff.waited:.1f}s waiting out rate limits" if backoff.waited else ""
+    print(f"Batch: {count} prompts, {errors} errors, {time.perf_counter() - started:.1f}s{waited}",
+          file=sys.stderr)
+    return errors
+
+
+def bench(server_ip, count):
+    """
+    Times `count` requests to /healthz, first each on a new connection, then over one
+    kept-alive connection, and prints how much connection setup a chat turn saves.
+    """
+    import statistics
+    load_requests()
+    url = f"http://{server_ip}:{SERVER_PORT}/healthz"
+
+    def timed(get):
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            get(url, timeout=10).raise_for_status()
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    def fresh_get(url, **kwargs):
+        with requests.Session() as session:
+            return session.get(url, **kwargs)
+
+    http = KeepAliveSession()
+    # Warm up DNS and the server before measuring
+    fresh_get(url, timeout=10)
+    fresh = timed(fresh_get)
+    kept = timed(http.get)
+    http.close()
+
+    for label, samples in (("New connection per request", fresh), ("Kept-alive session", kept)):
+        print(f"{label:<28} median {statistics.median(samples):7.2f} ms   "
+              f"mean {statistics.mean(samples):7.2f} ms   max {max(samples):7.2f} ms")
+    saved = statistics.median(fresh) - statistics.median(kept)
+    print(f"Connection setup saved per turn: {saved:.2f} ms (median)")
+    if saved <= 0:
+        print("No savings: the server may be closing connections after each response "
+              "(the development server does; 'server.py serve' keeps them alive).")
+
 
+def profile_imports(top=15):
+    """
+    Runs the client's imports in a fresh interpreter under -X importtime and prints
+    how long start-up takes and how much is deferred to the first network call.
+    """
+    import subprocess
+    marker = "client: first network call"
+    code = (f"import sys, client; print({marker!r}, file=sys.stderr, flush=True); "
+            "client.load_requests(); client.loads(b'{}')")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=SCRIPT_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr)
+        return
+
+    # Each line is "import time: <self us> | <cumulative us> | <indented module name>"
+    phases = {"startup": [], "deferred": []}
+    phase = "startup"
+    for line in result.stderr.splitlines():
+        if line == marker:
+            phase = "deferred"
+            continue
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        if name[1:2] != " ":
+            # Only top-level imports; nested ones are already in their parent's cumulative time
+            phases[phase].append((int(cumulative_us), name.strip()))
+
+    for phase, label in (("startup", "Start-up, before the prompt"), ("deferred", "Deferred to the first request")):
+        entries = sorted(phases[phase], reverse=True)
+        print(f"{label}: {sum(us for us, _ in entries) / 1000:.1f} ms in {len(entries)} top-level imports")
+        for us, name in entries[:top]:
+            print(f"  {us / 1000:8.2f} ms  {name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini LAN chat client.")
+    parser.add_argument("server_ip", nargs="?", help="Server IP address (asked for if omitted)")
+    parser.add_argument("--bench", action="store_true",
+                        help="Measure connection setup cost against the server and exit")
+    parser.add_argument("--bench-requests", type=int, default=50, metavar="N",
+                        help="Requests per measurement for --bench (default 50)")
+    parser.add_argument("--batch", metavar="FILE", type=argparse.FileType("r", encoding="utf-8"),
+                        help="Answer the JSONL prompts in FILE ('-' for stdin) without the interactive prompt")
+    parser.add_argument("--parallel", type=int, default=4, metavar="N",
+                        help="Requests to /chat/batch in flight at once in --batch mode (default 4)")
+    parser.add_argument("--output", metavar="FILE", type=argparse.FileType("w", encoding="utf-8"),
+                        default=sys.stdout,
+                        help="Write --batch results to FILE instead of stdout")
+    parser.add_argument("--profile-imports", action="store_true",
+                        help="Report where the client's import time goes and exit")
+    args = parser.parse_args(argv)
+
+    if args.profile_imports:
+        profile_imports()
+        return
+    if args.batch and not args.server_ip:
+        parser.error("--batch needs the server IP as an argument")
+    if args.parallel < 1:
+        parser.error("--parallel must be at least 1")
 
-def main():
-    # The Python script now asks for the IP address every time.
-    server_ip = input("Enter the server IP address: ").strip()
+    server_ip = args.server_ip or input("Enter the server IP address: ").strip()
     if not server_ip:
         print("ERROR: Server IP cannot be empty.")
         return
 
+    if args.batch:
+        with args.batch, args.output:
+            errors = run_batch(server_ip, args.batch, args.output, args.parallel)
+        sys.exit(1 if errors else 0)
+
+    if args.bench:
+        load_requests()
+        try:
+            bench(server_ip, args.bench_requests)
+        except requests.RequestException as e:
+            print(f"Benchmark failed: {e}")
+        return
+
     print("Gemini LAN Client")
     print(f"Connecting to server at: {server_ip}")
     print("Type 'exit' to quit, 'reset' to start a new conversation.")
     print("-" * 30)
 
-    chat_endpoint = f"http://{server_ip}:5000/chat"
-    reset_endpoint = f"http://{server_ip}:5000/reset_chat"
+    chat_endpoint = f"http://{server_ip}:{SERVER_PORT}/chat/stream"
+    reset_endpoint = f"http://{server_ip}:{SERVER_PORT}/reset_chat"
+    session_endpoint = f"http://{server_ip}:{SERVER_PORT}/session"
+
+    http = KeepAliveSession()
+    # Fetched with the first prompt, so nothing network-related is loaded before the user types
+    headers = None
 
     while True:
         try:
@@ -62,27 +478,38 @@ def main():
         if prompt.lower() == 'exit':
             break
         
+        if headers is None:
+            # Without a token the server tells clients apart by IP address only
+            try:
+                headers = new_session(http, session_endpoint)
+            except requests.RequestException as e:
+                print(f"Could not start a session, continuing without one: {e}")
+                headers = {}
+
         if prompt.lower() == 'reset':
             try:
-                response = requests.post(reset_endpoint)
+                response = http.post(reset_endpoint, headers=headers, timeout=10)
                 response.raise_for_status()
-                print(f"System: {response.json().get('message', 'Chat reset.')}")
+                print(f"System: {loads(response.content).get('message', 'Chat reset.')}")
             except requests.RequestException as e:
                 print(f"Error resetting chat: {e}")
             continue
 
         try:
-            response = requests.post(chat_endpoint, json={"prompt": prompt}, timeout=90)
-            response.raise_for_status()
-            data = response.json()
-            if "response" in data:
-                print(f"Gemini: {data['response']}")
-            elif "error" in data:
-                print(f"Server Error: {data['error']}")
+            try:
+                stream_chat(http, chat_endpoint, prompt, headers)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 401:
+                    raise
+                # The server was restarted with a new secret; start over with a fresh session
+                print("System: Session expired, starting a new conversation.")
+                headers = new_session(http, session_endpoint)
+                stream_chat(http, chat_endpoint, prompt, headers)
         except requests.exceptions.RequestException as e:
             print(f"An error occurred: {e}")
-        except json.JSONDecodeError:
-            print(f"Error decoding server response: {response.text}")
+        except ValueError as e:
+            print(f"Error decoding server response: {e}")
+    http.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
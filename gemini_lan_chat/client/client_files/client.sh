@@ -5,10 +5,17 @@ SCRIPT_DIR=$( cd -- "$( dirname -- "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )
 
 # Define paths relative to the script's location
 LIBS_DIR="$SCRIPT_DIR/libs"
+LIBS_ZIP="$SCRIPT_DIR/libs.zip"
 CLIENT_SCRIPT="$SCRIPT_DIR/client.py"
 BUNDLE_FILENAME="$SCRIPT_DIR/requests_bundle.zip"
 IP_CACHE_FILE="$SCRIPT_DIR/.server_ip_cache"
 
+# Checks the downloaded bundle against the SHA-256 in the server's manifest
+# (skipped if the server doesn't publish one)
+verify_bundle() {
+    python3 "$SCRIPT_DIR/verify_bundle.py" "$BUNDLE_FILENAME" "$PLATFORM" "$SERVER_IP"
+}
+
 run_setup() {
     echo "--- First-time setup: Installing dependencies ---"
     read -p "Enter the server's Public IP address: " SERVER_IP
@@ -16,45 +23,55 @@ run_setup() {
     
     echo "$SERVER_IP" > "$IP_CACHE_FILE"
 
-    BUNDLE_URL="http://${SERVER_IP}:5000/download_dependencies"
-    echo "Downloading from $SERVER_IP..."
-    curl -# -L -f -o "$BUNDLE_FILENAME" "$BUNDLE_URL"
-    
-    if [ $? -ne 0 ]; then echo "ERROR: Download failed. Check server IP and connection."; exit 1; fi
+    # Only this machine's libraries are downloaded
+    PLATFORM=$(python3 -c "import platform
+s, m = platform.system().lower(), platform.machine().lower()
+if s == 'linux': print('linux_x86_64' if m in ['x86_64', 'amd64'] else 'linux_aarch64')
+elif s == 'darwin': print('macos_arm64' if m == 'arm64' else 'macos_x86_64')
+")
+    if [ -z "$PLATFORM" ]; then echo "FATAL: Unsupported OS/Architecture ($(uname -s)/$(uname -m))"; exit 1; fi
+
+    BUNDLE_URL="http://${SERVER_IP}:5000/download_dependencies/${PLATFORM}"
+    echo "Downloading $PLATFORM libraries from $SERVER_IP..."
+    # -C - resumes a partial download left by an earlier, interrupted run
+    HTTP_CODE=$(curl -# -L -f -C - -o "$BUNDLE_FILENAME" -w "%{http_code}" "$BUNDLE_URL")
+    CURL_STATUS=$?
+    # -f fails on any HTTP error; only 416 is expected, when the earlier run had already got the whole file
+    if [ $CURL_STATUS -eq 22 ] && [ "$HTTP_CODE" != "416" ]; then
+        echo "ERROR: The server refused the download (HTTP $HTTP_CODE). Check server IP, or ask whether it has libraries for $PLATFORM."
+        exit 1
+    fi
+    if [ $CURL_STATUS -ne 0 ] && [ $CURL_STATUS -ne 22 ] && [ $CURL_STATUS -ne 33 ]; then
+        echo "ERROR: Download interrupted. Check server IP and connection, then run this script again to resume."
+        exit 1
+    fi
+
+    if ! verify_bundle; then
+        # The partial file was from an older bundle (or the server refused the range); start over
+        echo "Bundle is incomplete or out of date, downloading it again..."
+        rm -f "$BUNDLE_FILENAME"
+        curl -# -L -f -o "$BUNDLE_FILENAME" "$BUNDLE_URL"
+        if [ $? -ne 0 ]; then echo "ERROR: Download failed. Check server IP and connection."; exit 1; fi
+        if ! verify_bundle; then echo "ERROR: Downloaded bundle does not match the server's checksum."; rm -f "$BUNDLE_FILENAME"; exit 1; fi
+    fi
 
-    echo "Unpacking libraries..."
-    # Use python3 to perform platform-aware unzipping
-    python3 -c "import os, sys, platform, zipfile, shutil
-LIBS_DIR = '$LIBS_DIR'
-BUNDLE_FILENAME = '$BUNDLE_FILENAME'
-TEMP_EXTRACT_PATH = '$SCRIPT_DIR/temp_bundle_extract'
-def get_platform_identifier():
-    s, m = platform.system().lower(), platform.machine().lower()
-    if s == 'linux': return 'linux_x86_64' if m in ['x86_64', 'amd64'] else 'linux_aarch64'
-    if s == 'darwin': return 'macos_arm64' if m == 'arm64' else 'macos_x86_64'
-    return None
-p_dir = get_platform_identifier()
-if not p_dir: sys.exit(f'FATAL: Unsupported OS/Architecture ({platform.system()}/{platform.machine()})')
-with zipfile.ZipFile(BUNDLE_FILENAME, 'r') as zf: zf.extractall(TEMP_EXTRACT_PATH)
-source_dir = os.path.join(TEMP_EXTRACT_PATH, p_dir)
-if not os.path.exists(source_dir): sys.exit(f'FATAL: Bundle missing files for {p_dir}.')
-shutil.copytree(source_dir, LIBS_DIR)
-shutil.rmtree(TEMP_EXTRACT_PATH)
-"
+    echo "Packing libraries..."
+    # One zip with precompiled modules that client.py imports from directly, instead of extracting the bundle
+    python3 "$SCRIPT_DIR/make_libs_zip.py" "$BUNDLE_FILENAME" "$PLATFORM" "$LIBS_ZIP"
     if [ $? -ne 0 ]; then echo "ERROR: Failed to set up libraries."; rm -f "$BUNDLE_FILENAME"; exit 1; fi
     rm "$BUNDLE_FILENAME"
     echo "--- Setup complete! ---"
 }
 
 # --- Main Logic ---
-# Check if the libs directory exists. If not, run setup.
-if [ ! -d "$LIBS_DIR" ]; then
+# Check if the libraries are installed (libs.zip, or a libs directory from an older setup). If not, run setup.
+if [ ! -f "$LIBS_ZIP" ] && [ ! -d "$LIBS_DIR" ]; then
     run_setup
 fi
 
 # Get the cached server IP
 if [ ! -f "$IP_CACHE_FILE" ]; then
-    echo "Server IP not configured. Please run the setup again by deleting the 'libs' folder."
+    echo "Server IP not configured. Please run the setup again by deleting 'libs.zip'."
     exit 1
 else
     SERVER_IP=$(cat "$IP_CACHE_FILE")
@@ -0,0 +1,68 @@
+# make_libs_zip.py
+"""
+Turns a downloaded dependency bundle into libs.zip, which client.py imports
+from directly (zipimport) instead of from an extracted libs/ folder.
+
+    python3 make_libs_zip.py requests_bundle.zip linux_x86_64 libs.zip
+
+Only the given platform's files are copied, and every module is stored with
+its bytecode precompiled next to it, so imports don't have to compile
+anything on first run. Bytecode is only used by the Python that built it;
+other versions fall back to the .py sources in the same zip.
+
+Compiled extension modules (.so/.pyd) can't be imported from a zip and are
+left out. The libraries bundled for the client fall back to pure Python
+without them (charset_normalizer uses its md.py instead of the mypyc build).
+Data files stay in the zip too: certifi copies cacert.pem to a temporary file
+when requests asks for its path, and removes it again on exit.
+"""
+import importlib.util
+import marshal
+import os
+import sys
+import zipfile
+
+EXTENSION_SUFFIXES = ('.so', '.pyd', '.dylib', '.dll')
+
+
+def unchecked_pyc(source, filename):
+    """Compiles source into .pyc bytes that the import system uses without re-checking the source."""
+    code = compile(source, filename, 'exec', dont_inherit=True)
+    # Hash-based pyc (PEP 552) with check_source unset: flags=0b01, then the 8-byte source hash
+    return (importlib.util.MAGIC_NUMBER + (1).to_bytes(4, 'little')
+            + importlib.util.source_hash(source) + marshal.dumps(code))
+
+
+def build(bundle_path, platform, output_path):
+    prefix = platform + '/'
+    # Bytecode from a zip keeps the file name it was compiled with, so tracebacks point into libs.zip
+    archive_path = os.path.abspath(output_path)
+    tmp_path = output_path + '.tmp'
+    written = 0
+    with zipfile.ZipFile(bundle_path) as bundle, \
+            zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as libs:
+        for info in bundle.infolist():
+            if not info.filename.startswith(prefix) or info.is_dir():
+                continue
+            name = info.filename[len(prefix):]
+            if name.endswith(EXTENSION_SUFFIXES) or '/__pycache__/' in '/' + name:
+                continue
+            data = bundle.read(info)
+            libs.writestr(name, data)
+            written += 1
+            if name.endswith('.py'):
+                try:
+                    libs.writestr(name + 'c', unchecked_pyc(data, os.path.join(archive_path, name)))
+                except SyntaxError:
+                    # Code for newer Pythons; importing it would fail anyway
+                    pass
+    if not written:
+        os.remove(tmp_path)
+        sys.exit(f'FATAL: Bundle missing files for {platform}.')
+    os.replace(tmp_path, output_path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        sys.exit(f'Usage: {sys.argv[0]} BUNDLE PLATFORM OUTPUT')
+    build(*sys.argv[1:])
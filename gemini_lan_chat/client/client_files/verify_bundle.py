@@ -0,0 +1,57 @@
+# verify_bundle.py
+"""
+Checks a downloaded dependency bundle against the SHA-256 that the server
+publishes at /dependencies_manifest.
+
+    python3 verify_bundle.py requests_bundle.zip linux_x86_64 SERVER_IP
+
+The platform is "universal" for the bundle with every platform in it.
+
+Exits with 0 if the bundle matches and 1 if it doesn't (or is missing). A
+server that doesn't publish a manifest, or doesn't list this platform in it,
+gives nothing to check against, so the bundle is accepted as it is. Both
+client.sh and client.bat use this, so they behave the same.
+"""
+import hashlib
+import json
+import sys
+import urllib.request
+
+SERVER_PORT = 5000
+
+
+def bundle_name(platform):
+    return 'requests_bundle.zip' if platform == 'universal' else f'requests_bundle_{platform}.zip'
+
+
+def published_sha256(server_ip, platform):
+    """Returns the bundle's checksum from the server's manifest, or None if it doesn't publish one."""
+    url = f'http://{server_ip}:{SERVER_PORT}/dependencies_manifest'
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            info = json.loads(response.read())['files'].get(bundle_name(platform))
+    except Exception:
+        return None
+    return info['sha256'] if info else None
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        sys.exit(f'Usage: {sys.argv[0]} BUNDLE PLATFORM SERVER_IP')
+    bundle_path, platform, server_ip = sys.argv[1:]
+    expected = published_sha256(server_ip, platform)
+    if expected is None:
+        print('The server publishes no checksum for this bundle, skipping verification.')
+        sys.exit(0)
+    try:
+        sys.exit(0 if file_sha256(bundle_path) == expected else 1)
+    except OSError:
+        sys.exit(1)
@@ -0,0 +1,81 @@
+# bench_json.py
+"""
+Micro-benchmark of the JSON codecs available for chat bodies.
+
+Encodes and decodes payloads shaped like the server's replies (a /chat
+response, a /chat/batch response and a single SSE token event) with every
+installed codec, on replies of a few KB with some non-ASCII text:
+
+    python bench_json.py --sizes 2000,8000,32000 --number 2000
+"""
+import argparse
+import json
+import random
+import timeit
+
+WORDS = ("the model considers your question and explains each step so that students can follow "
+         "along with examples café naïve résumé 例え λ → ✓").split()
+
+
+def make_reply(size, rng):
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def payloads(size, rng):
+    return {
+        "chat": {"response": make_reply(size, rng)},
+        "batch": {"responses": [{"index": i, "response": make_reply(size // 8, rng)} for i in range(8)]},
+        "token": {"token": make_reply(48, rng)},
+    }
+
+
+def codecs():
+    """Returns {name: (dumps, loads)}, with dumps producing UTF-8 bytes like the server sends."""
+    available = {
+        "json": (lambda obj: json.dumps(obj).encode("utf-8"), json.loads),
+        "json (compact)": (lambda obj: json.dumps(obj, separators=(",", ":")).encode("ascii"), json.loads),
+        "json (compact, utf-8)": (
+            lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), json.loads),
+    }
+    try:
+        import orjson
+        available["orjson"] = (orjson.dumps, orjson.loads)
+    except ImportError:
+        pass
+    try:
+        import ujson
+        available["ujson"] = (lambda obj: ujson.dumps(obj, ensure_ascii=False).encode("utf-8"), ujson.loads)
+    except ImportError:
+        pass
+    return available
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="2000,8000,32000", help="Comma-separated reply sizes in characters")
+    parser.add_argument("--number", type=int, default=2000, help="Iterations per measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    available = codecs()
+    print(f"{'payload':<16}{'codec':<24}{'encode us':>11}{'decode us':>11}{'bytes':>9}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        for kind, obj in payloads(size, rng).items():
+            for name, (dumps, loads) in available.items():
+                encoded = dumps(obj)
+                assert loads(encoded) == obj
+                encode = min(timeit.repeat(lambda: dumps(obj), number=args.number, repeat=3)) / args.number
+                decode = min(timeit.repeat(lambda: loads(encoded), number=args.number, repeat=3)) / args.number
+                print(f"{kind + ' ' + str(size):<16}{name:<24}{encode * 1e6:>11.2f}{decode * 1e6:>11.2f}{len(encoded):>9}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
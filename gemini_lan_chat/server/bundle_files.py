@@ -0,0 +1,136 @@
+# bundle_files.py
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import zipfile
+
+UNIVERSAL_BUNDLE = 'requests_bundle.zip'
+# Written by j.py next to the bundles, with the size and SHA-256 of each one it built
+BUNDLES_INDEX = 'bundles_index.json'
+# Bundles cut from the universal bundle record its SHA-256 in their zip comment
+CARVED_FROM = b'carved-from-sha256:'
+# Platform names as used by j.py's TARGET_PLATFORMS, e.g. "linux_x86_64"
+PLATFORM_NAME = re.compile(r'^[a-z0-9_]+$')
+
+# mkstemp creates files readable only by their owner; published bundles get the
+# permissions of any other new file, so a reverse proxy or static host can read them.
+# Read once at import, as setting the umask to read it affects every thread.
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def platform_bundle_name(platform):
+    return f'requests_bundle_{platform}.zip'
+
+
+def bundle_names(directory):
+    """Names of the universal bundle and every per-platform bundle in `directory`."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(n for n in names if n == UNIVERSAL_BUNDLE
+                  or (n.startswith('requests_bundle_') and n.endswith('.zip')))
+
+
+def load_bundles_index(directory):
+    """Returns the parsed bundles index from j.py, or None if there is no readable one."""
+    try:
+        with open(os.path.join(directory, BUNDLES_INDEX)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def carved_from(path):
+    """SHA-256 of the universal bundle that the bundle at `path` was cut from, or None if it wasn't."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            comment = archive.comment
+    except (OSError, zipfile.BadZipFile):
+        return None
+    return comment[len(CARVED_FROM):].decode('ascii') if comment.startswith(CARVED_FROM) else None
+
+
+def carve_platform_bundle(directory, platform, source_sha256=None):
+    """
+    Writes the per-platform bundle for `platform` by copying its directory out of
+    the universal bundle. Returns the bundle's name, or None if the universal
+    bundle doesn't exist or has nothing for that platform.
+
+    The slim bundle keeps the "<platform>/" prefix, so clients unpack either
+    kind of bundle the same way. `source_sha256`, the universal bundle's digest,
+    is recorded so carved_from() can tell when the bundle needs cutting again.
+    """
+    prefix = platform + '/'
+    try:
+        source = zipfile.ZipFile(os.path.join(directory, UNIVERSAL_BUNDLE))
+    except FileNotFoundError:
+        return None
+    with source:
+        entries = [info for info in source.infolist() if info.filename.startswith(prefix)]
+        if not entries:
+            return None
+        fd, tmp_path = tempfile.mkstemp(suffix='.zip.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as target:
+                for info in entries:
+                    target.writestr(info, source.read(info), compress_type=zipfile.ZIP_DEFLATED)
+                if source_sha256:
+                    target.comment = CARVED_FROM + source_sha256.encode('ascii')
+            os.chmod(tmp_path, 0o644 & ~_UMASK)
+            name = platform_bundle_name(platform)
+            os.replace(tmp_path, os.path.join(directory, name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return name
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DigestCache:
+    """
+    SHA-256 digests of downloadable files, recomputed only when a file changes.
+
+    A file counts as changed when its size or modification time differs from
+    when it was last hashed, so replacing a bundle on disk takes effect on the
+    next request without restarting the server.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> (mtime_ns, size, sha256)
+        self._digests = {}
+
+    def get(self, path):
+        """Returns (sha256, size) for `path`; raises FileNotFoundError if it doesn't exist."""
+        st = os.stat(path)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2], st.st_size
+        digest = sha256_file(path)
+        with self._lock:
+            self._digests[path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest, st.st_size
+
+    def manifest(self, directory, names):
+        """Describes whichever of `names` exist in `directory`: {name: {"sha256", "size"}}."""
+        files = {}
+        for name in names:
+            try:
+                digest, size = self.get(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            files[name] = {"sha256": digest, "size": size}
+        return files
@@ -0,0 +1,381 @@
+# concurrency.py
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+
+class LockTimeout(Exception):
+    """Raised when a keyed lock could not be acquired in time."""
+
+
+class PoolSaturated(Exception):
+    """Raised when the upstream pool can't take more work; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamTimeout(TimeoutError):
+    """Raised when a started upstream call doesn't finish within the pool's call_timeout."""
+
+
+class KeyedLock:
+    """
+    One lock per key, created on demand and dropped once nobody holds or waits for it.
+
+    Used to serialize turns within a single conversation while requests for
+    other conversations proceed in parallel.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        # key -> [lock, number of holders and waiters]
+        self._locks = {}
+
+    @contextmanager
+    def hold(self, key, timeout=None):
+        with self._guard:
+            slot = self._locks.get(key)
+            if slot is None:
+                slot = self._locks[key] = [threading.Lock(), 0]
+            slot[1] += 1
+        try:
+            if not slot[0].acquire(timeout=-1 if timeout is None else timeout):
+                raise LockTimeout(f"Timed out waiting for lock on {key!r}")
+            try:
+                yield
+            finally:
+                slot[0].release()
+        finally:
+            with self._guard:
+                slot[1] -= 1
+                if slot[1] == 0:
+                    del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._calls = {}
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        """Returns (result, shared), where `shared` is True if another caller did the work."""
+        with self._guard:
+            call = self._calls.get(key)
+            if call is not None:
+                self.stats["coalesced"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.stats["leaders"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._guard:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class FairQueue:
+    """
+    FIFO per client, served weighted round robin across clients.
+
+    Each client with queued work takes turns; a client of weight w gets up to
+    w items popped per turn. Appending and popping are O(1).
+    """
+
+    def __init__(self):
+        # client -> [deque of items, weight]
+        self._queues = {}
+        self._ring = deque()
+        self._credit = 0
+        self._len = 0
+
+    def append(self, client, item, weight=1):
+        slot = self._queues.get(client)
+        if slot is None:
+            slot = self._queues[client] = [deque(), weight]
+            self._ring.append(client)
+        slot[1] = weight
+        slot[0].append(item)
+        self._len += 1
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError("pop from an empty FairQueue")
+        client = self._ring[0]
+        slot = self._queues[client]
+        if self._credit <= 0:
+            self._credit = max(1, slot[1])
+        item = slot[0].popleft()
+        self._credit -= 1
+        self._len -= 1
+        if not slot[0]:
+            del self._queues[client]
+            self._ring.popleft()
+            self._credit = 0
+        elif self._credit <= 0:
+            self._ring.rotate(-1)
+        return item
+
+    def queued(self, client):
+        slot = self._queues.get(client)
+        return len(slot[0]) if slot is not None else 0
+
+    def clients(self):
+        return len(self._queues)
+
+    def __len__(self):
+        return self._len
+
+
+class _PoolFuture(Future):
+    """A Future that also records when it was queued, and when a pool thread took it off the queue."""
+
+    def __init__(self, enqueued_at):
+        super().__init__()
+        self.enqueued_at = enqueued_at
+        self.started = threading.Event()
+        self.started_at = None
+
+
+class UpstreamPool:
+    """
+    Runs upstream model calls on a fixed number of threads with a bounded wait queue.
+
+    At most `max_in_flight` calls run at once and at most `max_queue` wait for
+    a free thread. Submitting to a full queue fails fast with PoolSaturated
+    instead of letting every request slowly time out, and so does a call that
+    hasn't started `queue_timeout` seconds after it was submitted: the caller
+    stops waiting and the call is cancelled, even while every thread is stuck
+    on slow upstream calls. A call that has started must finish within
+    `call_timeout` seconds (if set), or its caller gets UpstreamTimeout; the
+    thread itself stays busy until the upstream call returns.
+
+    Once all threads are busy, waiting calls are served weighted round robin
+    across the `client` each was submitted for, so one client with many
+    queued calls can't starve the others; a client may also have at most
+    `max_queue_per_client` calls waiting.
+
+    `on_wait(seconds)` and `on_call(seconds)`, if given, are called with each
+    call's time spent queued and time spent running.
+    """
+
+    def __init__(self, max_in_flight=16, max_queue=64, queue_timeout=30, max_queue_per_client=None,
+                 call_timeout=None, on_wait=None, on_call=None, clock=time.monotonic):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self.on_wait = on_wait
+        self.on_call = on_call
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._queue = FairQueue()
+        self._active = 0
+        self._pid = None
+        # Moving average of call duration, used to estimate Retry-After
+        self._avg_service = 1.0
+        self._stats = {"submitted": 0, "completed": 0, "rejected_full": 0, "rejected_client_full": 0,
+                       "rejected_timeout": 0, "call_timeouts": 0}
+
+    def _ensure_workers(self):
+        # Threads don't survive a fork, so each worker process starts its own
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for i in range(self.max_in_flight):
+            threading.Thread(target=self._work, name=f"upstream-{i}", daemon=True).start()
+
+    def retry_after(self):
+        """Estimates how many seconds until a newly queued call would start."""
+        waves = (len(self._queue) + 1) / self.max_in_flight
+        return max(1, math.ceil(waves * self._avg_service))
+
+    def saturated(self):
+        """True if a call submitted now would be rejected."""
+        return len(self._queue) >= self.max_queue
+
+    def submit(self, fn, client=None, weight=1):
+        """
+        Queues `fn()` on behalf of `client` and returns a Future for its result.
+
+        Wait for it with wait(), which applies the queue and call timeouts.
+        """
+        future = _PoolFuture(self._clock())
+        with self._cond:
+            self._ensure_workers()
+            if len(self._queue) >= self.max_queue:
+                self._stats["rejected_full"] += 1
+                raise PoolSaturated("Upstream queue is full", self.retry_after())
+            if self.max_queue_per_client and self._queue.queued(client) >= self.max_queue_per_client:
+                self._stats["rejected_client_full"] += 1
+                raise PoolSaturated("Too many queued upstream calls for this client", self.retry_after())
+            self._stats["submitted"] += 1
+            self._queue.append(client, (future, fn, future.enqueued_at), weight)
+            self._cond.notify()
+        return future
+
+    def wait_started(self, future):
+        """
+        Waits until a submitted call has been queued for queue_timeout seconds at
+        most. If it still hasn't started, cancels it and raises PoolSaturated.
+        """
+        timeout = max(0.0, future.enqueued_at + self.queue_timeout - self._clock())
+        if future.started.wait(timeout) or not future.cancel():
+            # Started, or a pool thread picked it up just as we gave up
+            return
+        with self._cond:
+            self._stats["rejected_timeout"] += 1
+        raise PoolSaturated(f"Waited {self.queue_timeout}s for an upstream slot", self.retry_after())
+
+    def remaining(self, future):
+        """Seconds the started call `future` has left before its call_timeout, or None for no limit."""
+        if self.call_timeout is None:
+            return None
+        future.started.wait()
+        return max(0.0, future.started_at + self.call_timeout - self._clock())
+
+    def call_timed_out(self):
+        """Counts a call whose caller gave up after call_timeout and returns the error to raise."""
+        with self._cond:
+            self._stats["call_timeouts"] += 1
+        return UpstreamTimeout(f"Upstream call took longer than {self.call_timeout}s")
+
+    def wait(self, future):
+        """Waits for a submitted call's result, applying queue_timeout and call_timeout."""
+        self.wait_started(future)
+        try:
+            return future.result(timeout=self.remaining(future))
+        except FutureTimeout:
+            raise self.call_timed_out() from None
+
+    def run(self, fn, client=None, weight=1):
+        """Runs `fn()` on the pool and waits for its result."""
+        return self.wait(self.submit(fn, client, weight))
+
+    def stream(self, fn, client=None, weight=1):
+        """
+        Runs `fn()` on the pool and yields the items of the iterable it returns.
+
+        The pool thread stays busy for the whole stream. If the consumer stops
+        early, production stops at the next item. The stream must start within
+        queue_timeout, and each item must arrive within call_timeout.
+        """
+        # Entries are (finished, item or exception)
+        items = queue.Queue()
+        cancelled = threading.Event()
+
+        def produce():
+            for item in fn():
+                if cancelled.is_set():
+                    return
+                items.put((False, item))
+
+        future = self.submit(produce, client, weight)
+        # Runs whether produce() finished, failed or was rejected while queued
+        future.add_done_callback(lambda f: items.put((True, None if f.cancelled() else f.exception())))
+
+        def consume():
+            try:
+                self.wait_started(future)
+                while True:
+                    try:
+                        # Streams can run long, so call_timeout bounds the wait for each item
+                        finished, item = items.get(timeout=self.call_timeout)
+                    except queue.Empty:
+                        raise self.call_timed_out() from None
+                    if finished:
+                        if item is not None:
+                            raise item
+                        return
+                    yield item
+            finally:
+                cancelled.set()
+
+        return consume()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, in_flight=self._active, queued=len(self._queue),
+                        queued_clients=self._queue.clients(), avg_call_seconds=round(self._avg_service, 3))
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                future, fn, enqueued = self._queue.popleft()
+                if future.cancelled():
+                    # Its caller stopped waiting for a slot
+                    continue
+                waited = self._clock() - enqueued
+                if waited > self.queue_timeout:
+                    # Only reached by callers not using wait(), which cancels calls that wait too long
+                    if future.set_running_or_notify_cancel():
+                        self._stats["rejected_timeout"] += 1
+                        future.started_at = self._clock()
+                        future.started.set()
+                        future.set_exception(PoolSaturated(
+                            f"Waited {waited:.1f}s for an upstream slot", self.retry_after()))
+                    continue
+                self._active += 1
+
+            if self.on_wait is not None:
+                self.on_wait(waited)
+            started = self._clock()
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.started_at = started
+                    future.started.set()
+                    try:
+                        future.set_result(fn())
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                elapsed = self._clock() - started
+                with self._cond:
+                    self._active -= 1
+                    self._stats["completed"] += 1
+                    self._avg_service = 0.9 * self._avg_service + 0.1 * elapsed
+                if self.on_call is not None:
+                    self.on_call(elapsed)
@@ -0,0 +1,129 @@
+# content_encoding.py
+"""
+Content-Encoding negotiation and compressors for chat responses.
+
+gzip and deflate are always available. br and zstd are offered when the
+brotli (or brotlicffi) and zstandard packages are installed, or, for zstd,
+on Python versions that ship compression.zstd. The client's vendored
+urllib3 decodes all four, so nothing changes on that side.
+"""
+import zlib
+
+try:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+
+GZIP_LEVEL = 6
+# Brotli's default quality (11) is far too slow for on-the-fly compression
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+
+class _ZlibStream:
+    def __init__(self, wbits):
+        self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, wbits)
+
+    def compress(self, data, flush=True):
+        # Sync-flush after each streamed chunk, so every event reaches the client right away
+        out = self._obj.compress(data)
+        return out + self._obj.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self):
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class _BrotliStream:
+    def __init__(self):
+        self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data, flush=True):
+        out = self._obj.process(data)
+        return out + self._obj.flush() if flush else out
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class _ZstdStream:
+    def __init__(self):
+        if zstd is not None:
+            self._obj = zstd.ZstdCompressor(level=ZSTD_LEVEL)
+            self._flush_block = zstd.ZstdCompressor.FLUSH_BLOCK
+        else:
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+
+    def compress(self, data, flush=True):
+        out = self._obj.compress(data)
+        return out + self._obj.flush(self._flush_block) if flush else out
+
+    def finish(self):
+        return self._obj.flush()
+
+
+# Preferred first when a client accepts several equally
+_STREAMS = {"gzip": lambda: _ZlibStream(16 + zlib.MAX_WBITS), "deflate": lambda: _ZlibStream(zlib.MAX_WBITS)}
+if brotli is not None:
+    _STREAMS = {"br": _BrotliStream, **_STREAMS}
+if zstd is not None or zstandard is not None:
+    _STREAMS = {"zstd": _ZstdStream, **_STREAMS}
+
+AVAILABLE = tuple(_STREAMS)
+
+
+def negotiate(accept_encoding, allowed=AVAILABLE):
+    """Picks the encoding to use for an Accept-Encoding header value, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for name in allowed:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress(data, encoding):
+    """Compresses a complete body."""
+    stream = _STREAMS[encoding]()
+    return stream.compress(data, flush=False) + stream.finish()
+
+
+def compress_stream(chunks, encoding):
+    """Compresses a streamed body chunk by chunk, flushing after each one."""
+    stream = _STREAMS[encoding]()
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if chunk:
+                yield stream.compress(chunk)
+        yield stream.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
@@ -0,0 +1,127 @@
+# history.py
+import os
+
+from session_backends import history_to_turns, turns_to_history
+
+# Rough conversion used for token budgets; good enough for English text
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PREFIX = "Summary of our conversation so far: "
+SUMMARY_ACK = "Understood, I'll keep that context in mind."
+
+
+def history_text_size(history):
+    """Approximates the memory held by a chat history as its total text length."""
+    size = 0
+    for content in history:
+        parts = content.get('parts', []) if isinstance(content, dict) else content.parts
+        for part in parts:
+            size += len(part if isinstance(part, str) else getattr(part, 'text', ''))
+    return size
+
+
+def estimate_tokens(history):
+    return history_text_size(history) // CHARS_PER_TOKEN
+
+
+def build_summary_prompt(turns):
+    """Builds the prompt asking the model to condense older turns of a conversation."""
+    transcript = "\n".join(f"{role.upper()}: {text}" for role, text in turns)
+    return (
+        "Summarize the following conversation between a student and an assistant in a few "
+        "short paragraphs. Keep names, definitions, code and decisions that later questions "
+        "may refer to. Reply with the summary only.\n\n" + transcript
+    )
+
+
+class HistoryPolicy:
+    """
+    Bounds how much conversation history each session keeps and resends upstream.
+
+    Once a session has more than `max_turns` exchanges, or its history is
+    estimated above `max_tokens`, older exchanges are either dropped
+    (strategy "drop") or condensed into a single summary exchange
+    (strategy "summarize"), keeping the most recent `keep_turns` exchanges
+    verbatim. Summaries are produced by `summarizer(turns)`, which calls the
+    model, so the SessionStore runs it in the background after a turn and
+    waits at most `summary_wait` seconds for it before the next one. If it
+    isn't ready by then, or fails, older exchanges are dropped instead.
+    """
+
+    STRATEGIES = ("drop", "summarize")
+
+    def __init__(self, max_turns=50, max_tokens=None, strategy="drop", keep_turns=None, summarizer=None,
+                 summary_wait=1.0):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown history strategy '{strategy}', expected one of {self.STRATEGIES}.")
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.summarizer = summarizer
+        self.summary_wait = summary_wait
+        if keep_turns is None:
+            # Dropping only needs to shed the excess; summarizing compacts further so it runs rarely
+            keep_turns = max_turns if strategy == "drop" else max(1, (max_turns or 2) // 2)
+        self.keep_turns = keep_turns
+
+    @classmethod
+    def from_env(cls, summarizer=None):
+        def env_int(name, default):
+            value = os.getenv(name)
+            return int(value) if value else default
+
+        return cls(
+            max_turns=env_int("HISTORY_MAX_TURNS", env_int("SESSION_MAX_HISTORY_TURNS", 50)),
+            max_tokens=env_int("HISTORY_MAX_TOKENS", 0) or None,
+            strategy=os.getenv("HISTORY_STRATEGY", "drop").lower(),
+            keep_turns=env_int("HISTORY_KEEP_TURNS", 0) or None,
+            summarizer=summarizer,
+            summary_wait=float(os.getenv("HISTORY_SUMMARY_WAIT") or 1.0),
+        )
+
+    @property
+    def summarizes(self):
+        return self.strategy == "summarize" and self.summarizer is not None
+
+    def over_limit(self, history):
+        if self.max_turns and len(history) > self.max_turns * 2:
+            return True
+        return bool(self.max_tokens) and estimate_tokens(history) > self.max_tokens
+
+    def _keep_items(self, history):
+        """Number of trailing history items to keep verbatim (always whole user/model pairs)."""
+        keep = min(len(history), self.keep_turns * 2) if self.keep_turns else len(history)
+        keep -= keep % 2
+        if self.max_tokens:
+            while keep > 2 and estimate_tokens(history[-keep:]) > self.max_tokens:
+                keep -= 2
+        return keep
+
+    def compact(self, history):
+        """
+        Returns the history with older exchanges dropped if it needs compacting, otherwise None.
+
+        The returned history always starts with a user turn.
+        """
+        if not self.over_limit(history):
+            return None
+        keep = self._keep_items(history)
+        return list(history[-keep:]) if keep else []
+
+    def summarize(self, history):
+        """
+        Condenses the exchanges compact() would drop by calling the summarizer.
+
+        Returns (summarized_items, summary) for apply_summary(), or None if
+        there is nothing to summarize.
+        """
+        summarized = len(history) - self._keep_items(history)
+        if not summarized:
+            return None
+        return summarized, self.summarizer(history_to_turns(history[:summarized]))
+
+    @staticmethod
+    def apply_summary(history, summarized):
+        """Replaces the first items of `history` with the summary exchange from summarize()."""
+        count, summary = summarized
+        return turns_to_history([("user", SUMMARY_PREFIX + summary), ("model", SUMMARY_ACK)]) + list(history[count:])
@@ -1,8 +1,14 @@
 # create_bundle.py
+import argparse
+import hashlib
+import json
 import os
 import subprocess
 import shutil
+import sys
+import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 # The libraries you want to bundle. 'requests' is the primary one.
@@ -24,72 +30,248 @@ TARGET_PLATFORMS = [
     ("linux_aarch64", "manylinux2014_aarch64"),
 ]
 
-# The name of the temporary build directory and final zip file.
-BUILD_DIR = "build_temp"
+# Python version the client machines run (wheels are picked for its ABI)
+PYTHON_VERSION = "39"
+
+# Downloaded wheels, extracted wheels and assembled platform directories are kept
+# here between runs, so unchanged platforms are not rebuilt.
+CACHE_DIR = ".bundle_cache"
 ZIP_FILENAME = "requests_bundle.zip"
+# Each platform also gets its own slim archive, e.g. requests_bundle_linux_x86_64.zip,
+# listed with its size and SHA-256 in the index file.
+PLATFORM_ZIP_TEMPLATE = "requests_bundle_{}.zip"
+INDEX_FILENAME = "bundles_index.json"
 # --- End Configuration ---
 
-def create_bundle():
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_index(platform_archives):
+    """Writes INDEX_FILENAME, describing the universal archive and each platform's archive."""
+    def describe(filename):
+        return {"file": filename, "size": os.path.getsize(filename), "sha256": file_sha256(filename)}
+
+    index = {
+        "universal": describe(ZIP_FILENAME),
+        "platforms": {dir_name: describe(filename) for dir_name, filename in platform_archives.items()},
+    }
+    with open(INDEX_FILENAME, 'w') as f:
+        json.dump(index, f, indent=2)
+    print(f"Wrote {INDEX_FILENAME}")
+
+class WheelCache:
+    """
+    Content-addressed store of wheels and their extracted contents.
+
+    Wheels are stored under their SHA-256, so a wheel shared by several
+    platforms (most are pure Python) is kept and extracted only once.
+    """
+
+    def __init__(self, root):
+        self.wheels_dir = os.path.join(root, "wheels")
+        self.extracted_dir = os.path.join(root, "extracted")
+        os.makedirs(self.wheels_dir, exist_ok=True)
+        os.makedirs(self.extracted_dir, exist_ok=True)
+
+    def add(self, wheel_path):
+        """Stores a wheel and returns its SHA-256."""
+        digest = file_sha256(wheel_path)
+        target = os.path.join(self.wheels_dir, digest + ".whl")
+        if not os.path.exists(target):
+            fd, tmp = tempfile.mkstemp(dir=self.wheels_dir)
+            os.close(fd)
+            shutil.copyfile(wheel_path, tmp)
+            os.replace(tmp, target)
+        return digest
+
+    def extracted(self, digest):
+        """Returns the directory holding the wheel's extracted files, extracting it on first use."""
+        target = os.path.join(self.extracted_dir, digest)
+        if not os.path.isdir(target):
+            tmp = tempfile.mkdtemp(dir=self.extracted_dir)
+            with zipfile.ZipFile(os.path.join(self.wheels_dir, digest + ".whl"), 'r') as whl_zip:
+                whl_zip.extractall(tmp)
+            try:
+                os.rename(tmp, target)
+            except OSError:
+                # Another platform's build extracted it first
+                shutil.rmtree(tmp)
+        return target
+
+def zip_platforms(zip_path, build_dir, dir_names):
+    """Archives the given platform directories of `build_dir`, each under its own name."""
+    tmp = zip_path + ".tmp"
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for dir_name in dir_names:
+            root_dir = os.path.join(build_dir, dir_name)
+            for folder, subfolders, files in os.walk(root_dir):
+                subfolders.sort()
+                relative = os.path.relpath(folder, build_dir)
+                archive.write(folder, relative)
+                for name in sorted(files):
+                    archive.write(os.path.join(folder, name), os.path.join(relative, name))
+    os.replace(tmp, zip_path)
+
+def fetch_wheels(platform_tag, download_dir, wheelhouse=None):
+    """
+    Runs pip download for one platform and returns the names of the wheels it
+    resolved, now in `download_dir`; raises CalledProcessError on failure.
+
+    pip saves into an empty directory and finds the wheels of earlier runs
+    through --find-links, so whatever that directory holds afterwards is
+    exactly this run's resolution, without reading pip's output.
+    """
+    fresh_dir = tempfile.mkdtemp(dir=os.path.dirname(download_dir))
+    try:
+        command = [
+            sys.executable, "-m", "pip", "download",
+            PACKAGE_TO_BUNDLE,
+            "--platform", platform_tag,
+            "--python-version", PYTHON_VERSION,
+            "--abi", f"cp{PYTHON_VERSION}",
+            "--only-binary=:all:",
+            "--progress-bar", "off",
+            "--find-links", download_dir,
+            "-d", fresh_dir,
+        ]
+        if wheelhouse:
+            # Offline: resolve everything from the local wheelhouse
+            command += ["--no-index", "--find-links", wheelhouse]
+        subprocess.run(command, check=True, capture_output=True, text=True)
+        wheels = sorted(name for name in os.listdir(fresh_dir) if name.endswith(".whl"))
+        for name in wheels:
+            os.replace(os.path.join(fresh_dir, name), os.path.join(download_dir, name))
+        return wheels
+    finally:
+        shutil.rmtree(fresh_dir, ignore_errors=True)
+
+def build_platform(dir_name, platform_tag, cache, fingerprints, wheelhouse=None, force=False):
+    """
+    Fetches the wheels for one platform and assembles its directory and slim archive.
+
+    Returns (dir_name, fingerprint, rebuilt), or raises CalledProcessError if pip failed.
+    The platform is only reassembled when its fingerprint (the platform tag,
+    Python version and the hashes of all its wheels) differs from the last build.
+    """
+    download_dir = os.path.join(CACHE_DIR, "downloads", dir_name)
+    os.makedirs(download_dir, exist_ok=True)
+    # Wheels left from an earlier run stay here, so pip only downloads what changed
+    resolved = {}
+    for item in fetch_wheels(platform_tag, download_dir, wheelhouse):
+        resolved[item] = cache.add(os.path.join(download_dir, item))
+
+    fingerprint = hashlib.sha256(json.dumps(
+        [PACKAGE_TO_BUNDLE, platform_tag, PYTHON_VERSION, sorted(resolved.values())]).encode()).hexdigest()
+    build_dir = os.path.join(CACHE_DIR, "build")
+    target_dir = os.path.join(build_dir, dir_name)
+    platform_zip = PLATFORM_ZIP_TEMPLATE.format(dir_name)
+    if (not force and fingerprints.get(dir_name) == fingerprint
+            and os.path.isdir(target_dir) and os.path.exists(platform_zip)):
+        return dir_name, fingerprint, False
+
+    if os.path.exists(target_dir):
+        shutil.rmtree(target_dir)
+    for item, digest in resolved.items():
+        print(f"[{dir_name}] Adding {item}")
+        shutil.copytree(cache.extracted(digest), target_dir, dirs_exist_ok=True)
+
+    # The slim archives keep the platform directory at their root, so clients unpack them like the universal one
+    zip_platforms(platform_zip, build_dir, [dir_name])
+    return dir_name, fingerprint, True
+
+def create_bundle(platforms=TARGET_PLATFORMS, wheelhouse=None, jobs=None, force=False):
     """
     Downloads and bundles platform-specific wheels for the specified package.
+
+    Platforms are fetched in parallel. Only platforms whose wheels changed
+    since the last run are rebuilt. The universal archive holds every platform
+    built so far (in this run or an earlier one) and is rebuilt when any of
+    them changed.
     """
-    if os.path.exists(BUILD_DIR):
-        print(f"Removing old build directory: {BUILD_DIR}")
-        shutil.rmtree(BUILD_DIR)
-    
-    os.makedirs(BUILD_DIR, exist_ok=True)
-    print(f"Created build directory: {BUILD_DIR}")
-
-    for dir_name, platform_tag in TARGET_PLATFORMS:
-        target_dir = os.path.join(BUILD_DIR, dir_name)
-        os.makedirs(target_dir, exist_ok=True)
-        print("\n" + "="*50)
-        print(f"Fetching packages for: {dir_name} (platform: {platform_tag})")
-        print("="*50)
-
-        # Use pip to download the package and its dependencies for the specific platform
-        try:
-            subprocess.run(
-                [
-                    "pip", "download",
-                    PACKAGE_TO_BUNDLE,
-                    "--platform", platform_tag,
-                    "--python-version", "39",
-                    "--abi", "cp39",
-                    "--only-binary=:all:",
-                    "-d", target_dir, # Download to the specific platform directory
-                ],
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            
-            # Unzip all the downloaded wheel files into the same directory
-            for item in os.listdir(target_dir):
-                if item.endswith(".whl"):
-                    whl_path = os.path.join(target_dir, item)
-                    print(f"Unzipping {item}...")
-                    with zipfile.ZipFile(whl_path, 'r') as whl_zip:
-                        whl_zip.extractall(target_dir)
-                    os.remove(whl_path) # Clean up the .whl file
-
-        except subprocess.CalledProcessError as e:
-            print(f"ERROR: Failed to download for {dir_name}.")
-            print(f"Pip output:\n{e.stderr}")
-            print("\nThis can happen if a pre-compiled wheel is not available for a specific dependency on this platform.")
-            print("Skipping this platform...")
-            continue
-    
-    # Create the final zip file
+    cache = WheelCache(os.path.join(CACHE_DIR, "store"))
+    state_path = os.path.join(CACHE_DIR, "state.json")
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        state = {}
+    # Fingerprints of the last successful build of each platform, and of the universal archive
+    fingerprints = state.setdefault("platforms", {})
+
+    print("="*50)
+    print(f"Fetching packages for: {', '.join(dir_name for dir_name, _ in platforms)}"
+          + (f" (offline, from {wheelhouse})" if wheelhouse else ""))
+    print("="*50)
+
+    built_platforms = []
+    with ThreadPoolExecutor(max_workers=jobs or len(platforms)) as executor:
+        futures = {
+            executor.submit(build_platform, dir_name, platform_tag, cache, fingerprints, wheelhouse, force): dir_name
+            for dir_name, platform_tag in platforms
+        }
+        for future, dir_name in futures.items():
+            try:
+                _, fingerprint, rebuilt = future.result()
+            except subprocess.CalledProcessError as e:
+                print(f"ERROR: Failed to download for {dir_name}.")
+                print(f"Pip output:\n{e.stderr}")
+                print("\nThis can happen if a pre-compiled wheel is not available for a specific dependency on this platform.")
+                print("Skipping this platform...")
+                continue
+            fingerprints[dir_name] = fingerprint
+            built_platforms.append(dir_name)
+            print(f"[{dir_name}] {'Rebuilt' if rebuilt else 'Unchanged, reusing'} {PLATFORM_ZIP_TEMPLATE.format(dir_name)}")
+
+    if not built_platforms:
+        print("\nERROR: No platform could be built.")
+        return
+
+    # Create the universal zip file from every platform that has been built
+    build_dir = os.path.join(CACHE_DIR, "build")
+    universal_platforms = [dir_name for dir_name, _ in TARGET_PLATFORMS
+                           if dir_name in fingerprints and os.path.isdir(os.path.join(build_dir, dir_name))]
+    universal_fingerprint = hashlib.sha256(json.dumps(
+        [(dir_name, fingerprints[dir_name]) for dir_name in universal_platforms]).encode()).hexdigest()
     print("\n" + "="*50)
-    print(f"Creating final archive: {ZIP_FILENAME}")
-    shutil.make_archive(ZIP_FILENAME.replace('.zip', ''), 'zip', BUILD_DIR)
-    print(f"Successfully created {ZIP_FILENAME}")
+    if force or state.get("universal") != universal_fingerprint or not os.path.exists(ZIP_FILENAME):
+        print(f"Creating final archive: {ZIP_FILENAME}")
+        zip_platforms(ZIP_FILENAME, build_dir, universal_platforms)
+        state["universal"] = universal_fingerprint
+        print(f"Successfully created {ZIP_FILENAME}")
+    else:
+        print(f"No platform changed, keeping {ZIP_FILENAME}")
+
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+    write_index({dir_name: PLATFORM_ZIP_TEMPLATE.format(dir_name) for dir_name in universal_platforms
+                 if os.path.exists(PLATFORM_ZIP_TEMPLATE.format(dir_name))})
+    print(f"\nDone! Now, upload '{ZIP_FILENAME}', the '{PLATFORM_ZIP_TEMPLATE.format('*')}' files "
+          f"and '{INDEX_FILENAME}' to your server's 'static_files' directory.")
+
+def main():
+    global CACHE_DIR, PYTHON_VERSION
+    parser = argparse.ArgumentParser(description="Builds the client dependency bundles.")
+    parser.add_argument("--platform", action="append", dest="platforms",
+                        choices=[dir_name for dir_name, _ in TARGET_PLATFORMS],
+                        help="Only build these platforms (repeatable; default: all)")
+    parser.add_argument("--wheelhouse", help="Build offline from the wheels in this directory, "
+                                             "e.g. static_files/requests_packages")
+    parser.add_argument("--python-version", default=PYTHON_VERSION,
+                        help=f"Client Python version, without the dot (default {PYTHON_VERSION})")
+    parser.add_argument("--jobs", type=int, help="Platforms to fetch at once (default: all)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help=f"Build cache (default {CACHE_DIR})")
+    parser.add_argument("--force", action="store_true", help="Rebuild every platform even if unchanged")
+    args = parser.parse_args()
 
-    # Clean up the build directory
-    shutil.rmtree(BUILD_DIR)
-    print("Cleaned up temporary build directory.")
-    print(f"\nDone! Now, upload '{ZIP_FILENAME}' to your server's 'static_files' directory.")
+    CACHE_DIR = args.cache_dir
+    PYTHON_VERSION = args.python_version
+    platforms = [p for p in TARGET_PLATFORMS if not args.platforms or p[0] in args.platforms]
+    create_bundle(platforms, wheelhouse=args.wheelhouse, jobs=args.jobs, force=args.force)
 
 if __name__ == "__main__":
-    create_bundle()
\ No newline at end of file
+    main()
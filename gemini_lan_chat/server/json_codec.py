@@ -0,0 +1,56 @@
+# json_codec.py
+"""
+JSON encoding for request and response bodies.
+
+Uses orjson when it is installed and the standard library otherwise. Both
+paths produce compact UTF-8 bytes directly, so a large reply is encoded once
+instead of being built as a str and encoded again on the way out.
+"""
+import json
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    NAME = "orjson"
+
+    def dumps(obj):
+        """Encodes `obj` as compact UTF-8 JSON bytes."""
+        return orjson.dumps(obj)
+
+    def loads(data):
+        """Decodes JSON from bytes or str."""
+        return orjson.loads(data)
+else:
+    NAME = "json"
+    # ensure_ascii=False would save bytes on non-ASCII replies but encodes much slower (see bench_json.py)
+    _encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def dumps(obj):
+        """Encodes `obj` as compact UTF-8 JSON bytes."""
+        return _encoder.encode(obj).encode("ascii")
+
+    def loads(data):
+        """Decodes JSON from bytes or str."""
+        return json.loads(data)
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider for `jsonify` and `request.get_json` backed by this module's codec."""
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # Skip the str round trip of JSONProvider.response
+        return self._app.response_class(dumps(obj) + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,317 @@
+# loadgen.py
+"""
+Load generator for the LAN chat server.
+
+Simulates N clients, each with its own chat session, driving /chat,
+/reset_chat and /download_dependencies with a configurable think time, then
+reports latency percentiles, throughput, error rates and the server's RSS
+over the run. Getting each client's session token is reported as the
+"session" operation; a client that can't get one counts as an error and
+sends nothing else.
+
+Run it against a server using the fake model backend for repeatable numbers:
+
+    python loadgen.py --spawn-server --clients 50 --duration 60
+
+or against an already running server (each simulated client asks /session
+for its own session token):
+
+    python loadgen.py --url http://192.168.1.10:5000 --clients 50
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+PROMPTS = [
+    "What is a linked list?",
+    "Explain recursion with an example.",
+    "How does TCP differ from UDP?",
+    "Write a Python function that reverses a string.",
+    "What does the HTTP 404 status code mean?",
+    "Summarize the causes of deadlock.",
+]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Results:
+    """Thread-safe collection of per-operation latencies and errors, with why each error happened."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.error_reasons = {}
+        self.rss_samples = []
+
+    def record(self, op, latency, ok, reason=None):
+        with self._lock:
+            self.latencies.setdefault(op, []).append(latency)
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+                reasons = self.error_reasons.setdefault(op, {})
+                reasons[reason] = reasons.get(reason, 0) + 1
+
+    def record_rss(self, elapsed, rss_bytes):
+        with self._lock:
+            self.rss_samples.append((elapsed, rss_bytes))
+
+    def summary(self, elapsed):
+        report = {"duration_s": round(elapsed, 2), "operations": {}}
+        total = errors = 0
+        for op, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            op_errors = self.errors.get(op, 0)
+            total += len(values)
+            errors += op_errors
+            report["operations"][op] = {
+                "requests": len(values),
+                "errors": op_errors,
+                "error_rate": round(op_errors / len(values), 4),
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+            }
+            if op_errors:
+                report["operations"][op]["error_reasons"] = dict(self.error_reasons[op])
+        report["total"] = {
+            "requests": total,
+            "errors": errors,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "throughput_rps": round(total / elapsed, 2),
+        }
+        rss = [r for _, r in self.rss_samples if r is not None]
+        if rss:
+            report["server_rss_mb"] = {
+                "start": round(rss[0] / 2**20, 1),
+                "max": round(max(rss) / 2**20, 1),
+                "end": round(rss[-1] / 2**20, 1),
+                "samples": [(round(t, 1), round(r / 2**20, 1)) for t, r in self.rss_samples if r is not None],
+            }
+        return report
+
+
+class SimulatedClient(threading.Thread):
+    """One chat user: keeps a keep-alive connection and loops over weighted operations."""
+
+    def __init__(self, index, host, port, args, results, deadline, seed):
+        super().__init__(daemon=True)
+        self.index = index
+        self.session_token = None
+        self.host, self.port = host, port
+        self.args = args
+        self.results = results
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.conn = None
+
+    def _request(self, method, path, body=None):
+        headers = {"X-Session-Token": self.session_token} if self.session_token else {}
+        if body is not None:
+            body = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.args.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                # Read the whole body, streamed or not, so timings include the full reply
+                data = b"".join(iter(lambda: response.read(65536), b""))
+                return response.status, data
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def _start_session(self):
+        """Asks /session for a token; returns None on success, else why it failed."""
+        try:
+            status, data = self._request("POST", "/session")
+        except (http.client.HTTPException, OSError) as e:
+            return f"{type(e).__name__}: {e}"
+        try:
+            body = json.loads(data)
+        except ValueError:
+            body = {}
+        if status != 200:
+            message = body.get("error") if isinstance(body, dict) else None
+            return f"HTTP {status}: {message}" if message else f"HTTP {status}"
+        if not isinstance(body, dict) or "session_token" not in body:
+            return "Response without a session_token"
+        self.session_token = body["session_token"]
+        return None
+
+    def run(self):
+        start = time.perf_counter()
+        reason = self._start_session()
+        self.results.record("session", time.perf_counter() - start, reason is None, reason)
+        if reason is not None:
+            print(f"Client {self.index} could not get a session token: {reason}", file=sys.stderr)
+            return
+        ops = [op for op, _ in self.args.mix]
+        weights = [w for _, w in self.args.mix]
+        while time.monotonic() < self.deadline:
+            op = self.rng.choices(ops, weights)[0]
+            if op == "chat":
+                path = "/chat/stream" if self.args.stream else "/chat"
+                request = ("POST", path, {"prompt": self.rng.choice(PROMPTS)})
+            elif op == "reset":
+                request = ("POST", "/reset_chat", None)
+            else:
+                request = ("GET", "/download_dependencies", None)
+
+            start = time.perf_counter()
+            reason = None
+            try:
+                status, _ = self._request(*request)
+                ok = status < 400
+                if not ok:
+                    reason = f"HTTP {status}"
+            except (http.client.HTTPException, OSError) as e:
+                ok, reason = False, type(e).__name__
+            self.results.record(op, time.perf_counter() - start, ok, reason)
+
+            if self.args.think_time:
+                time.sleep(self.rng.expovariate(1 / self.args.think_time))
+        if self.conn is not None:
+            self.conn.close()
+
+
+def sample_rss(host, port, results, start, stop_event, interval):
+    """Polls the server's /stats endpoint for its resident memory."""
+    while not stop_event.is_set():
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=5)
+            conn.request("GET", "/stats")
+            stats = json.loads(conn.getresponse().read())
+            conn.close()
+            results.record_rss(time.monotonic() - start, stats.get("process", {}).get("rss_bytes"))
+        except (http.client.HTTPException, OSError, ValueError):
+            pass
+        stop_event.wait(interval)
+
+
+def spawn_fake_server(port):
+    """Starts server.py on `port` with the fake model backend and waits until it answers."""
+    env = dict(os.environ, MODEL_BACKEND="fake", PORT=str(port))
+    # Every simulated client shares one IP and chats faster than a person would
+    env.setdefault("RATE_LIMIT_IP_PER_MINUTE", "0")
+    env.setdefault("RATE_LIMIT_SESSION_PER_MINUTE", "0")
+    env.setdefault("RATE_LIMIT_SESSION_CREATE_PER_MINUTE", "0")
+    env.setdefault("UPSTREAM_MAX_QUEUE_PER_CLIENT", "0")
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    process = subprocess.Popen([sys.executable, server_script], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/stats")
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("Server process exited during startup.")
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Server did not start within 10 seconds.")
+
+
+def parse_mix(value):
+    """Parses 'chat=80,reset=5,download=15' into [(op, weight), ...]."""
+    mix = []
+    for item in value.split(","):
+        op, _, weight = item.partition("=")
+        if op not in ("chat", "reset", "download"):
+            raise argparse.ArgumentTypeError(f"Unknown operation '{op}' in --mix")
+        mix.append((op, float(weight or 1)))
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator for the Gemini LAN chat server.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Base URL of the server")
+    parser.add_argument("--clients", type=int, default=10, help="Number of simulated clients")
+    parser.add_argument("--duration", type=float, default=30, help="Length of the run in seconds")
+    parser.add_argument("--think-time", type=float, default=1.0,
+                        help="Mean pause between a client's requests in seconds (exponentially distributed)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=90,reset=5,download=5"),
+                        help="Weighted operation mix, e.g. chat=90,reset=5,download=5")
+    parser.add_argument("--stream", action="store_true", help="Use /chat/stream instead of /chat")
+    parser.add_argument("--timeout", type=float, default=90, help="Per-request timeout in seconds")
+    parser.add_argument("--rss-interval", type=float, default=2.0, help="Seconds between server RSS samples")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for prompts, operation mix and think times")
+    parser.add_argument("--spawn-server", action="store_true",
+                        help="Start a local server.py with the fake model backend for the run")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--max-error-rate", type=float, help="Exit with status 1 if the error rate exceeds this")
+    parser.add_argument("--max-p95-ms", type=float, help="Exit with status 1 if chat p95 latency exceeds this")
+    args = parser.parse_args(argv)
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+
+    server_process = spawn_fake_server(port) if args.spawn_server else None
+    try:
+        results = Results()
+        start = time.monotonic()
+        deadline = start + args.duration
+        stop_sampling = threading.Event()
+        sampler = threading.Thread(target=sample_rss, daemon=True,
+                                   args=(host, port, results, start, stop_sampling, args.rss_interval))
+        sampler.start()
+
+        clients = [SimulatedClient(i, host, port, args, results, deadline, args.seed + i)
+                   for i in range(args.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.monotonic() - start
+        stop_sampling.set()
+        sampler.join()
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+    report = results.summary(elapsed)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if args.max_error_rate is not None and report["total"]["error_rate"] > args.max_error_rate:
+        print(f"FAIL: error rate {report['total']['error_rate']} exceeds {args.max_error_rate}")
+        failed = True
+    # Checked on its own too: the requests of the clients that did start can dilute the total rate
+    sessions = report["operations"].get("session")
+    if args.max_error_rate is not None and sessions and sessions["error_rate"] > args.max_error_rate:
+        print(f"FAIL: {sessions['errors']} of {sessions['requests']} clients could not start a session")
+        failed = True
+    chat = report["operations"].get("chat")
+    if args.max_p95_ms is not None and chat and chat["p95_ms"] > args.max_p95_ms:
+        print(f"FAIL: chat p95 {chat['p95_ms']} ms exceeds {args.max_p95_ms} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
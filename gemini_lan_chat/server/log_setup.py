@@ -0,0 +1,47 @@
+# log_setup.py
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+_queue = None
+_handlers = ()
+_listener = None
+
+
+def _start_listener():
+    global _listener
+    _listener = logging.handlers.QueueListener(_queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def configure_logging(level="INFO"):
+    """
+    Sends all log records through a queue to a background writer thread.
+
+    Request threads only pay for putting a record on the queue; formatting
+    and console I/O happen on the listener thread. The listener is restarted
+    in forked worker processes, where the parent's thread no longer exists.
+    """
+    global _queue, _handlers
+    if _queue is not None:
+        return
+    _queue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"))
+    _handlers = (console,)
+
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(_queue)]
+    root.setLevel(level)
+
+    _start_listener()
+    atexit.register(_stop_listener)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_start_listener)
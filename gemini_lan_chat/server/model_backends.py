@@ -0,0 +1,167 @@
+# model_backends.py
+import hashlib
+import os
+import random
+import threading
+import time
+
+DEFAULT_GEMINI_MODEL = 'gemini-2.5-flash'
+
+# Words the fake model builds its replies from
+_FAKE_VOCABULARY = (
+    "the model considers your question and explains each step in turn so that "
+    "students can follow along with examples from the lab exercise before moving "
+    "on to the next topic where a short summary closes the answer"
+).split()
+
+
+class FakeUpstreamError(Exception):
+    """Simulated transient failure of the fake model backend."""
+
+    # Same attribute google.api_core errors use, so it is classified as retryable
+    code = 503
+
+
+class FakeChunk:
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    """
+    Mimics a GenerateContentResponse: `.text` for the full reply, or iteration
+    over chunks when the request was made with stream=True.
+    """
+
+    def __init__(self, chunks, on_complete=None):
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self._text = None
+
+    def __iter__(self):
+        parts = []
+        for chunk in self._chunks:
+            parts.append(chunk)
+            yield FakeChunk(chunk)
+        self._finish(parts)
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._finish(list(self._chunks))
+        return self._text
+
+    def _finish(self, parts):
+        if self._text is None:
+            self._text = "".join(parts)
+            if self._on_complete is not None:
+                self._on_complete(self._text)
+
+
+class FakeChatSession:
+    """Mimics genai's ChatSession: keeps a history and appends each completed exchange."""
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False):
+        contents = self.history + [{"role": "user", "parts": [content]}]
+
+        def on_complete(text):
+            self.history = contents + [{"role": "model", "parts": [text]}]
+
+        return self.model.generate_content(contents, stream=stream, _on_complete=on_complete)
+
+
+class FakeModel:
+    """
+    Deterministic stand-in for GenerativeModel, for load testing without the real service.
+
+    Reply text depends only on the prompt, the history length and the seed.
+    Time to first token follows a log-normal distribution around `latency_ms`,
+    after which tokens are produced at `tokens_per_sec`. A fraction
+    `error_rate` of calls fails with FakeUpstreamError before producing output.
+    """
+
+    def __init__(self, model_name='models/fake', latency_ms=800, latency_sigma=0.5,
+                 tokens_per_sec=50, reply_tokens=120, error_rate=0.0, seed=0):
+        self.model_name = model_name
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.seed = seed
+        # Latencies and failures come from one seeded stream, so a run's distribution is repeatable
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency_ms=float(os.getenv("FAKE_LATENCY_MS", "800")),
+            latency_sigma=float(os.getenv("FAKE_LATENCY_SIGMA", "0.5")),
+            tokens_per_sec=float(os.getenv("FAKE_TOKENS_PER_SEC", "50")),
+            reply_tokens=int(os.getenv("FAKE_REPLY_TOKENS", "120")),
+            error_rate=float(os.getenv("FAKE_ERROR_RATE", "0")),
+            seed=int(os.getenv("FAKE_SEED", "0")),
+        )
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
+
+    def generate_content(self, contents, stream=False, _on_complete=None):
+        if isinstance(contents, str):
+            contents = [{"role": "user", "parts": [contents]}]
+        prompt = "".join(str(part) for part in contents[-1]["parts"])
+
+        with self._rng_lock:
+            first_token_delay = self._rng.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+            failed = self._rng.random() < self.error_rate
+
+        chunks = self._reply_chunks(prompt, len(contents), first_token_delay, failed)
+        response = FakeResponse(chunks, _on_complete)
+        if not stream:
+            # Like the real client, a non-streaming call returns only once the whole reply exists
+            response.text
+        return response
+
+    def _reply_chunks(self, prompt, history_len, first_token_delay, failed):
+        time.sleep(first_token_delay)
+        if failed:
+            raise FakeUpstreamError("Simulated upstream failure (503 Service Unavailable)")
+
+        digest = hashlib.sha256(f"{self.seed}:{history_len}:{prompt}".encode("utf-8")).digest()
+        words = [f"Reply to '{prompt[:40]}':"]
+        for i in range(self.reply_tokens):
+            words.append(_FAKE_VOCABULARY[digest[i % len(digest)] * (i + 1) % len(_FAKE_VOCABULARY)])
+
+        token_delay = 1 / self.tokens_per_sec if self.tokens_per_sec else 0
+        # Emit a few tokens per chunk, roughly like the real streaming API
+        for start in range(0, len(words), 8):
+            batch = words[start:start + 8]
+            time.sleep(token_delay * len(batch))
+            yield " ".join(batch) + " "
+
+
+def _create_gemini_model():
+    import google.generativeai as genai
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not found in .env file or environment variables.")
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(os.getenv("GEMINI_MODEL", DEFAULT_GEMINI_MODEL))
+
+
+def create_model():
+    """Builds the model backend selected by MODEL_BACKEND ('gemini' or 'fake')."""
+    backend_name = os.getenv("MODEL_BACKEND", "gemini").lower()
+    if backend_name == "fake":
+        return FakeModel.from_env()
+    if backend_name == "gemini":
+        return _create_gemini_model()
+    raise ValueError(f"Unknown MODEL_BACKEND '{backend_name}', expected 'gemini' or 'fake'.")
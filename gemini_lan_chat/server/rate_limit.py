@@ -0,0 +1,118 @@
+# rate_limit.py
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated', 'throttled_since', 'throttled_until', 'throttled_seconds', 'rejected')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.throttled_since = None
+        self.throttled_until = None
+        self.throttled_seconds = 0.0
+        self.rejected = 0
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter keyed by client (a session or an IP address).
+
+    Each key earns `rate` tokens per second up to `burst`, and each request
+    spends `cost` tokens; a request without enough tokens is rejected with
+    the number of seconds until it would be allowed. A request costing more
+    than `burst` is allowed once the bucket is full and leaves it in debt, so
+    the key still pays for all of it before its next request. Buckets are refilled
+    lazily on access, so every check is O(1). At most `max_keys` buckets are
+    kept, dropping the least recently used.
+
+    A key counts as throttled from its first rejection until it is allowed
+    again (or could have been, if it gave up); `throttled()` reports that time
+    per key.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._stats = {"allowed": 0, "rejected": 0}
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        return bucket
+
+    def acquire(self, key, cost=1):
+        """Spends `cost` tokens for `key`. Returns 0 if allowed, else seconds to wait before retrying."""
+        # A bucket never holds more than burst, so larger costs only need a full one
+        needed = min(cost, self.burst)
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(key, now)
+            if bucket.tokens >= needed:
+                bucket.tokens -= cost
+                if bucket.throttled_since is not None:
+                    bucket.throttled_seconds += min(now, bucket.throttled_until) - bucket.throttled_since
+                    bucket.throttled_since = None
+                self._stats["allowed"] += 1
+                return 0
+            wait = (needed - bucket.tokens) / self.rate
+            if bucket.throttled_since is None:
+                bucket.throttled_since = now
+            bucket.throttled_until = now + wait
+            bucket.rejected += 1
+            self._stats["rejected"] += 1
+            return wait
+
+    def refund(self, key, cost=1):
+        """Gives back tokens spent by a request that was rejected by another limiter."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.tokens = min(self.burst, bucket.tokens + cost)
+
+    def throttled(self, limit=20):
+        """Returns the `limit` keys that have spent the longest throttled, with their totals."""
+        with self._lock:
+            now = self._clock()
+            totals = []
+            for key, bucket in self._buckets.items():
+                seconds = bucket.throttled_seconds
+                if bucket.throttled_since is not None:
+                    seconds += min(now, bucket.throttled_until) - bucket.throttled_since
+                if bucket.rejected:
+                    totals.append((seconds, bucket.rejected, key))
+        totals.sort(reverse=True)
+        return [{"client": key, "throttled_seconds": round(seconds, 3), "rejected": rejected}
+                for seconds, rejected, key in totals[:limit]]
+
+    def stats(self):
+        with self._lock:
+            now = self._clock()
+            throttled_now = 0
+            throttled_seconds = 0.0
+            for bucket in self._buckets.values():
+                throttled_seconds += bucket.throttled_seconds
+                if bucket.throttled_since is not None:
+                    throttled_seconds += min(now, bucket.throttled_until) - bucket.throttled_since
+                    throttled_now += bucket.throttled_until > now
+            return dict(self._stats, tracked_clients=len(self._buckets), throttled_now=throttled_now,
+                        throttled_seconds=round(throttled_seconds, 3))
+
+
+def retry_after_seconds(wait):
+    """Rounds a wait up to whole seconds for the Retry-After header."""
+    return max(1, math.ceil(wait))
@@ -0,0 +1,227 @@
+# resilience.py
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from concurrency import PoolSaturated, UpstreamTimeout
+
+# HTTP status codes (exposed as `.code` by google.api_core errors) worth retrying
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(error):
+    """True for upstream failures that are likely to succeed if retried."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return getattr(error, 'code', None) in TRANSIENT_STATUS_CODES
+
+
+class CircuitOpen(Exception):
+    """Raised while the circuit breaker is refusing upstream calls."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails fast once too many recent upstream calls have failed transiently.
+
+    The breaker looks at the outcome of the last `window` calls. When at least
+    `min_calls` are recorded and the failure ratio reaches `failure_ratio`, it
+    opens for `cooldown` seconds. After that a single trial call is let
+    through: success closes the breaker, failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window=20, failure_ratio=0.5, min_calls=10, cooldown=30, clock=time.monotonic):
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._clock = clock
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_started = None
+        self._stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self):
+        """Raises CircuitOpen if a call should not be attempted right now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            remaining = self._opened_at + self.cooldown - self._clock()
+            if self._state == self.OPEN and remaining <= 0:
+                self._state = self.HALF_OPEN
+            now = self._clock()
+            # A trial whose outcome never got recorded (e.g. the client went away) expires
+            if self._state == self.HALF_OPEN and (
+                    self._trial_started is None or now - self._trial_started > self.cooldown):
+                self._trial_started = now
+                return
+            self._stats["rejected"] += 1
+            raise CircuitOpen("Upstream is failing, not sending new requests for now",
+                              max(1, math.ceil(remaining)))
+
+    def record(self, success):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._trial_started = None
+                if success:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (self._state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_ratio):
+                self._open()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._stats["opened"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, state=self._state)
+
+
+class ResilientUpstream:
+    """
+    Wraps upstream calls on an UpstreamPool with retries, hedging and a circuit breaker.
+
+    Transient failures are retried up to `max_retries` times with full-jitter
+    exponential backoff. If a call runs for `hedge_after` seconds without a
+    reply, a second identical call is started and whichever succeeds first
+    wins, so calls passed to `call()` must be safe to run twice. Streams are
+    only retried if they fail before producing anything, and are never hedged.
+    Calls that overran the pool's `call_timeout` are not retried, since their
+    thread is still busy with the stuck call. Only transient failures count
+    against the circuit breaker.
+    """
+
+    def __init__(self, pool, breaker, max_retries=2, backoff_base=0.2, backoff_max=5.0,
+                 hedge_after=None, sleep=time.sleep):
+        self.pool = pool
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self._sleep = sleep
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+        self._stats = {"retries": 0, "hedges_launched": 0, "hedge_wins": 0, "hedge_saved_seconds": 0.0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _backoff(self, attempt):
+        return self._rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, fn, client=None, weight=1):
+        """Runs `fn()` on the pool for `client` with retries and hedging, returning its result."""
+        for attempt in range(self.max_retries + 1):
+            self.breaker.allow()
+            try:
+                result = self._hedged(fn, client, weight)
+            except PoolSaturated:
+                # Our own backpressure, not an upstream failure
+                raise
+            except Exception as e:
+                # Errors caused by the request itself (bad input, blocked content) say nothing about upstream health
+                self.breaker.record(not is_transient(e))
+                if not is_transient(e) or isinstance(e, UpstreamTimeout) or attempt == self.max_retries:
+                    raise
+                self._count("retries")
+                self._sleep(self._backoff(attempt))
+                continue
+            self.breaker.record(True)
+            return result
+
+    def stream(self, fn, client=None, weight=1):
+        """Yields the items of the iterable returned by `fn()`, retrying failures before the first item."""
+        for attempt in range(self.max_retries + 1):
+            self.breaker.allow()
+            started = False
+            try:
+                for item in self.pool.stream(fn, client, weight):
+                    started = True
+                    yield item
+            except PoolSaturated:
+                raise
+            except Exception as e:
+                # Errors caused by the request itself (bad input, blocked content) say nothing about upstream health
+                self.breaker.record(not is_transient(e))
+                if (started or not is_transient(e) or isinstance(e, UpstreamTimeout)
+                        or attempt == self.max_retries):
+                    raise
+                self._count("retries")
+                self._sleep(self._backoff(attempt))
+                continue
+            self.breaker.record(True)
+            return
+
+    def _hedged(self, fn, client, weight):
+        primary = self.pool.submit(fn, client, weight)
+        if not self.hedge_after:
+            return self.pool.wait(primary)
+        # Hedge on time spent running; while the primary is still queued a hedge would only queue behind it
+        self.pool.wait_started(primary)
+        remaining = self.pool.remaining(primary)
+        done, _ = wait([primary], timeout=self.hedge_after if remaining is None
+                       else min(self.hedge_after, remaining))
+        if done:
+            return primary.result()
+        try:
+            hedge = self.pool.submit(fn, client, weight)
+        except PoolSaturated:
+            # No spare capacity to hedge with, just keep waiting
+            return self.pool.wait(primary)
+        self._count("hedges_launched")
+
+        # Both calls share the primary's deadline
+        pending, error = {primary, hedge}, None
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=self.pool.remaining(primary), return_when=FIRST_COMPLETED)
+                if not done:
+                    raise error or self.pool.call_timed_out()
+                for future in done:
+                    if future.cancelled():
+                        continue
+                    if future.exception() is not None:
+                        error = future.exception()
+                        continue
+                    if future is hedge:
+                        self._count("hedge_wins")
+                        won_at = time.monotonic()
+                        # Credit hedging with the time the primary call took beyond the hedge
+                        primary.add_done_callback(
+                            lambda f: self._count("hedge_saved_seconds", time.monotonic() - won_at))
+                    return future.result()
+        finally:
+            # Free the hedge's queue slot if it never got to run
+            hedge.cancel()
+        raise error
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hedge_saved_seconds"] = round(stats["hedge_saved_seconds"], 3)
+        stats["circuit_breaker"] = self.breaker.stats()
+        return stats
@@ -0,0 +1,114 @@
+# response_cache.py
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt):
+    """
+    Reduces a prompt to a canonical form so trivially different phrasings share a cache key.
+
+    Unicode is NFKC-normalized, case is folded, runs of whitespace collapse to
+    one space and trailing sentence punctuation is ignored.
+    """
+    prompt = unicodedata.normalize("NFKC", prompt).casefold()
+    prompt = _WHITESPACE.sub(" ", prompt).strip()
+    return prompt.rstrip(" ?!.")
+
+
+def cache_key(model_name, prompt, turns=()):
+    """Builds a cache key from the model, the normalized prompt and the (role, text) history."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([model_name, normalize_prompt(prompt), list(turns)]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU cache of model replies with a TTL and optional on-disk persistence.
+
+    Entries are persisted to an append-only JSON-lines file, one line per
+    insert, so writes stay cheap. The file is replayed (and compacted) when the
+    cache is created.
+    """
+
+    def __init__(self, max_entries=1000, ttl=3600, path=None, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._log = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        if path:
+            self._load()
+            self._log = open(path, "a", encoding="utf-8")
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                expires, value = item
+                if expires > self._clock():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        expires = self._clock() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            if self._log is not None:
+                self._log.write(json.dumps([key, expires, value]) + "\n")
+                self._log.flush()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        now = self._clock()
+        lines = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                lines += 1
+                try:
+                    key, expires, value = json.loads(line)
+                except ValueError:
+                    continue
+                if expires > now:
+                    self._entries[key] = (expires, value)
+                    self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if lines > len(self._entries):
+            # Rewrite the log with only the live entries
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for key, (expires, value) in self._entries.items():
+                    f.write(json.dumps([key, expires, value]) + "\n")
+            os.replace(tmp_path, self.path)
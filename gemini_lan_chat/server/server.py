@@ -1,26 +1,394 @@
 import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import flask
-from flask import Flask, request, jsonify, send_from_directory
-import google.generativeai as genai
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context
 from dotenv import load_dotenv
+from werkzeug.exceptions import HTTPException
+from bundle_files import (PLATFORM_NAME, UNIVERSAL_BUNDLE, DigestCache, bundle_names, carve_platform_bundle,
+                          carved_from, load_bundles_index, platform_bundle_name)
+import content_encoding
+import json_codec
+from log_setup import configure_logging
+from metrics import SIZE_BUCKETS, Registry
+from model_backends import create_model
+from concurrency import KeyedLock, LockTimeout, PoolSaturated, SingleFlight, UpstreamPool, UpstreamTimeout
+from resilience import CircuitBreaker, CircuitOpen, ResilientUpstream
+from response_cache import ResponseCache, cache_key
+from session_backends import (MemorySessionBackend, SqliteSessionBackend, StaleSession, append_exchange,
+                              history_to_turns)
+from session_store import SessionStore
+from session_tokens import InvalidSessionToken, SessionTokens
+from rate_limit import RateLimiter, retry_after_seconds
+from history import HistoryPolicy, build_summary_prompt
+import serving
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Logging goes through a background thread; prompts and replies are only logged at DEBUG
+configure_logging(os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger("gemini_lan_chat")
+
+# Request metrics, exposed in Prometheus text format at /metrics
+metrics = Registry()
+REQUESTS = metrics.counter("chat_requests_total", "HTTP requests by route and status", ["route", "status"])
+REQUEST_SECONDS = metrics.histogram("chat_request_seconds", "Time to fully serve a request", ["route"])
+QUEUE_WAIT_SECONDS = metrics.histogram("chat_upstream_queue_wait_seconds", "Time upstream calls wait for a pool slot")
+UPSTREAM_SECONDS = metrics.histogram("chat_upstream_call_seconds", "Duration of individual upstream calls")
+SERIALIZATION_SECONDS = metrics.histogram(
+    "chat_serialization_seconds", "Time spent encoding response bodies", ["route"])
+RESPONSE_BYTES = metrics.histogram("chat_response_bytes", "Response body size", ["route"], buckets=SIZE_BUCKETS)
+
 # Configure Flask app
 app = Flask(__name__)
+# jsonify and request.get_json go through orjson when it is installed
+app.json = json_codec.FastJSONProvider(app)
 STATIC_DIR = 'static_files'
 app.config['STATIC_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), STATIC_DIR)
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in .env file or environment variables.")
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-2.5-flash') # Or your preferred model
+# Configure the model backend: the Gemini API by default, or MODEL_BACKEND=fake
+# for a deterministic local stand-in used in load tests
+model = create_model()
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+def _create_session_backend():
+    """Picks where chat histories are persisted, based on SESSION_BACKEND."""
+    backend_name = os.getenv("SESSION_BACKEND", "memory").lower()
+    if backend_name == "sqlite":
+        db_path = os.getenv("SESSION_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.db"))
+        backend = SqliteSessionBackend(db_path)
+        purged = backend.purge_idle(_env_int("SESSION_RETENTION", 7 * 24 * 3600))
+        logger.info("Using SQLite session backend at %s (%d expired sessions purged)", db_path, purged)
+        return backend
+    if backend_name != "memory":
+        raise ValueError(f"Unknown SESSION_BACKEND '{backend_name}', expected 'memory' or 'sqlite'.")
+    return MemorySessionBackend()
+
+def _summarize_turns(turns):
+    """Asks the model to condense older turns of a conversation (HISTORY_STRATEGY=summarize)."""
+    prompt = build_summary_prompt(turns)
+    return upstream.call(lambda: model.generate_content(prompt).text)
+
+# Active conversations, keyed by client IP, cached in memory.
+# Sessions are evicted when idle for too long or when the store is full, and
+# reloaded from the session backend (if it persists them) on the next request.
+# Each session's history is capped by HISTORY_MAX_TURNS / HISTORY_MAX_TOKENS.
+# With HISTORY_STRATEGY=summarize the summary is made in the background after a
+# reply; the next turn waits up to HISTORY_SUMMARY_WAIT seconds for it, then
+# drops the older turns instead.
+session_store = SessionStore(
+    factory=lambda history: model.start_chat(history=history),
+    backend=_create_session_backend(),
+    max_entries=_env_int("SESSION_MAX_ENTRIES", 500),
+    idle_ttl=_env_int("SESSION_IDLE_TTL", 1800),
+    max_bytes=_env_int("SESSION_MAX_BYTES", 64 * 1024 * 1024),
+    history_policy=HistoryPolicy.from_env(summarizer=_summarize_turns),
+)
+
+# Turns within one conversation are serialized; other conversations run in parallel.
+# The lock only covers this process: with several workers, a turn answered while
+# another worker changed the same session fails to store (StaleSession) and is
+# answered again from the updated history, up to SESSION_CONFLICT_RETRIES times.
+session_locks = KeyedLock()
+SESSION_LOCK_TIMEOUT = _env_int("SESSION_LOCK_TIMEOUT", 120)
+SESSION_CONFLICT_RETRIES = _env_int("SESSION_CONFLICT_RETRIES", 2)
+
+# Upstream model calls run on a bounded pool; when its wait queue is full, or a
+# call waits longer than UPSTREAM_QUEUE_TIMEOUT for a thread, the request is
+# rejected with 503 and a Retry-After hint. Calls running longer than
+# UPSTREAM_CALL_TIMEOUT (0 for no limit) fail with 504.
+# Queued calls are served round robin across client IP addresses, so opening
+# more chat sessions doesn't get a machine a bigger share of the pool.
+upstream_pool = UpstreamPool(
+    max_in_flight=_env_int("UPSTREAM_MAX_IN_FLIGHT", 16),
+    max_queue=_env_int("UPSTREAM_MAX_QUEUE", 64),
+    queue_timeout=_env_int("UPSTREAM_QUEUE_TIMEOUT", 30),
+    max_queue_per_client=_env_int("UPSTREAM_MAX_QUEUE_PER_CLIENT", 16),
+    call_timeout=_env_int("UPSTREAM_CALL_TIMEOUT", 60) or None,
+    on_wait=QUEUE_WAIT_SECONDS.observe,
+    on_call=UPSTREAM_SECONDS.observe,
+)
+
+def _parse_client_weights(value):
+    """Parses '192.168.1.10=4,192.168.1.11=2' into {ip: weight}."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        ip, _, weight = item.partition("=")
+        weights[ip.strip()] = int(weight)
+    return weights
+
+# Clients listed here (e.g. the instructor's machine) get a bigger share of the pool when it is busy
+UPSTREAM_CLIENT_WEIGHTS = _parse_client_weights(os.getenv("UPSTREAM_CLIENT_WEIGHTS", ""))
+
+# Transient upstream errors are retried with jittered backoff, slow calls can be
+# hedged with a duplicate request, and a circuit breaker fails fast while the
+# upstream error rate is high
+upstream = ResilientUpstream(
+    upstream_pool,
+    CircuitBreaker(
+        window=_env_int("BREAKER_WINDOW", 20),
+        failure_ratio=_env_int("BREAKER_FAILURE_PERCENT", 50) / 100,
+        min_calls=_env_int("BREAKER_MIN_CALLS", 10),
+        cooldown=_env_int("BREAKER_COOLDOWN", 30),
+    ),
+    max_retries=_env_int("UPSTREAM_MAX_RETRIES", 2),
+    backoff_base=_env_int("UPSTREAM_RETRY_BASE_MS", 200) / 1000,
+    hedge_after=_env_int("UPSTREAM_HEDGE_AFTER_MS", 0) / 1000 or None,
+)
+
+# Identical stateless prompts that arrive while one is in flight share its reply
+COALESCE_STATELESS = os.getenv("COALESCE_STATELESS", "1") != "0"
+stateless_flight = SingleFlight()
+
+# /chat/batch sends at most BATCH_MAX_CONCURRENCY of a batch's stateless prompts
+# upstream at once. They queue on upstream_pool under the client's IP address like
+# any other call, so a big batch takes turns with interactive clients instead of
+# filling the pool, and a prompt left waiting past UPSTREAM_QUEUE_TIMEOUT fails.
+BATCH_MAX_PROMPTS = _env_int("BATCH_MAX_PROMPTS", 64)
+BATCH_MAX_CONCURRENCY = _env_int("BATCH_MAX_CONCURRENCY", 4)
+
+# Opt-in cache of replies to stateless prompts and to the first turns of fresh sessions
+response_cache = None
+if os.getenv("RESPONSE_CACHE", "0") == "1":
+    response_cache = ResponseCache(
+        max_entries=_env_int("RESPONSE_CACHE_MAX_ENTRIES", 1000),
+        ttl=_env_int("RESPONSE_CACHE_TTL", 3600),
+        path=os.getenv("RESPONSE_CACHE_PATH") or None,
+    )
+# Sessions with at most this many previous exchanges can be answered from the cache
+CACHE_MAX_HISTORY_TURNS = _env_int("RESPONSE_CACHE_MAX_HISTORY_TURNS", 0)
+
+def _session_cache_key(chat_session, prompt):
+    """Returns the cache key for a session turn, or None if the history is too long to cache."""
+    if response_cache is None:
+        return None
+    history = chat_session.history
+    if len(history) > CACHE_MAX_HISTORY_TURNS * 2:
+        return None
+    return cache_key(model.model_name, prompt, history_to_turns(history))
+
+def _generate_stateless(prompt, client=None, weight=1):
+    """Answers a prompt without any conversation history."""
+    key = None
+    if response_cache is not None:
+        key = cache_key(model.model_name, prompt)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached
+
+    def call():
+        text = upstream.call(lambda: model.generate_content(prompt).text, client, weight)
+        if key is not None:
+            response_cache.put(key, text)
+        return text
+    if not COALESCE_STATELESS:
+        return call()
+    text, shared = stateless_flight.do((model.model_name, prompt), call)
+    if shared:
+        logger.debug("Served stateless prompt from a coalesced in-flight request")
+    return text
+
+def _session_turn(client_id, prompt, pool_client=None, weight=1):
+    """Sends one turn of the client's conversation, answering from the cache when possible."""
+    for attempt in range(SESSION_CONFLICT_RETRIES + 1):
+        chat_session = session_store.get(client_id)
+        key = _session_cache_key(chat_session, prompt)
+        text = response_cache.get(key) if key is not None else None
+        if text is not None:
+            append_exchange(chat_session, prompt, text)
+        else:
+            history = list(chat_session.history)
+
+            def attempt_turn():
+                # Each attempt works on its own copy, so retries and hedges can't corrupt the history
+                attempt_session = model.start_chat(history=history)
+                return attempt_session.send_message(prompt).text, attempt_session.history
+
+            text, chat_session.history = upstream.call(attempt_turn, pool_client, weight)
+            if key is not None:
+                response_cache.put(key, text)
+        try:
+            session_store.record_turn(client_id)
+        except StaleSession:
+            if attempt == SESSION_CONFLICT_RETRIES:
+                raise
+            logger.info("Session %s was changed by another worker during a turn, answering again", client_id)
+            continue
+        return text
+
+def _session_busy_response():
+    return jsonify({"error": "Another request for this chat session is still in progress."}), 409
+
+SESSION_CONFLICT_MESSAGE = "This chat session was changed by another request at the same time, please retry."
+
+def _session_conflict_response():
+    return jsonify({"error": SESSION_CONFLICT_MESSAGE}), 409
+
+def _overloaded_response(retry_after, message="Server is overloaded, please retry shortly."):
+    response = jsonify({"error": message, "retry_after": retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+# Clients ask /session for a signed token and send it back in X-Session-Token, so that
+# several clients behind one NAT or proxy each get their own conversation.
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+if not SESSION_SECRET:
+    # Forked workers inherit this one, but tokens stop working when the server restarts
+    logger.warning("SESSION_SECRET is not set; session tokens will not survive a restart.")
+session_tokens = SessionTokens(SESSION_SECRET or os.urandom(32))
+
+def _client_id():
+    """Identifies the conversation a request belongs to: its session token, else the client's IP address."""
+    token = request.headers.get('X-Session-Token')
+    if token:
+        return session_tokens.verify(token)
+    return request.remote_addr
+
+def _pool_client():
+    """Who this request's upstream calls are queued for: scheduling and queue caps are per IP address."""
+    return request.remote_addr
+
+def _client_weight():
+    """Share of the upstream pool this request's client gets while calls are queued."""
+    return UPSTREAM_CLIENT_WEIGHTS.get(request.remote_addr, 1)
 
-# In-memory storage for conversations, keyed by client IP
-active_chats = {}
+# Token buckets per session and per IP address; a rate of 0 turns a limiter off.
+# By default a chat session (or a client without one) may send 20 prompts a minute,
+# 5 at once, a machine 300 a minute, 60 at once, across its sessions, and a machine
+# may start 30 sessions a minute, 10 at once. The bundled tools run against these
+# defaults by waiting out the 429s: client.py --batch sends its prompts through
+# /chat/batch, which a full bucket admits whole, and async_client.py retries after
+# Retry-After, so --sessions 30 spends about 40s waiting for its last sessions.
+# loadgen.py --spawn-server turns the limits off to measure the server itself.
+def _create_rate_limiter(prefix, per_minute, burst):
+    rate = _env_int(f"{prefix}_PER_MINUTE", per_minute)
+    if not rate:
+        return None
+    return RateLimiter(rate / 60, _env_int(f"{prefix}_BURST", burst))
+
+session_rate_limiter = _create_rate_limiter("RATE_LIMIT_SESSION", 20, 5)
+ip_rate_limiter = _create_rate_limiter("RATE_LIMIT_IP", 300, 60)
+# Per IP address, so a client can't get around the per-session limit by starting new sessions
+session_create_rate_limiter = _create_rate_limiter("RATE_LIMIT_SESSION_CREATE", 30, 10)
+
+def _too_many_requests_response(wait):
+    retry_after = retry_after_seconds(wait)
+    response = jsonify({"error": "Too many requests, please slow down.", "retry_after": retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def _throttle(client_id, cost=1):
+    """Charges a chat request to the session's and the IP's buckets; returns a 429 response if either is empty."""
+    limiters = [(session_rate_limiter, client_id), (ip_rate_limiter, request.remote_addr)]
+    charged = []
+    for limiter, key in limiters:
+        if limiter is None:
+            continue
+        wait = limiter.acquire(key, cost)
+        if wait:
+            for charged_limiter, charged_key in charged:
+                charged_limiter.refund(charged_key, cost)
+            return _too_many_requests_response(wait)
+        charged.append((limiter, key))
+    return None
+
+def _current_rss_bytes():
+    """Returns the resident memory of this process, or None if it can't be determined."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Fall back to peak RSS, which is reported in bytes on macOS and kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _sse_event(data, event=None):
+    """Formats a dict as a single server-sent event."""
+    started = time.perf_counter()
+    message = b"data: " + json_codec.dumps(data) + b"\n\n"
+    if event:
+        message = f"event: {event}\n".encode("ascii") + message
+    SERIALIZATION_SECONDS.observe(time.perf_counter() - started, route="/chat/stream")
+    return message
+
+def _route_label():
+    # The URL rule rather than the path, so label values stay bounded
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+def _instrumented_stream(body, route, started):
+    """Passes a streamed body through, recording its size and duration once it ends."""
+    size = 0
+    try:
+        for chunk in body:
+            size += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+        RESPONSE_BYTES.observe(size, route=route)
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    route = _route_label()
+    REQUESTS.inc(route=route, status=str(response.status_code))
+    started = g.get('request_started', time.perf_counter())
+    if response.mimetype == 'text/event-stream':
+        response.response = _instrumented_stream(response.response, route, started)
+    else:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+        RESPONSE_BYTES.observe(response.content_length or 0, route=route)
+    return response
+
+# Responses are compressed when the client accepts it; bodies under COMPRESS_MIN_BYTES
+# aren't worth it. Streams are compressed as they go, flushing after every event.
+COMPRESSION = os.getenv("COMPRESSION", "1") != "0"
+COMPRESS_MIN_BYTES = _env_int("COMPRESS_MIN_BYTES", 1024)
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/event-stream', 'text/plain'}
+
+@app.after_request
+def _compress_response(response):
+    # Registered after the metrics hook, so it runs first and response sizes are measured compressed
+    if not COMPRESSION or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    encoding = content_encoding.negotiate(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = content_encoding.compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(content_encoding.compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def _overloaded_event(retry_after, message="Server is overloaded, please retry shortly."):
+    return _sse_event({"error": message, "retry_after": retry_after}, event="error")
 
 @app.route('/chat', methods=['POST'])
 def chat_handler():
@@ -29,56 +397,466 @@ def chat_handler():
 
     data = request.get_json()
     prompt = data.get('prompt')
-    client_id = request.remote_addr
+    client_id = _client_id()
 
     if not prompt:
         return jsonify({"error": "Missing 'prompt' in request"}), 400
 
-    print(f"Received prompt from {client_id}: {prompt}")
+    logger.debug("Received prompt from %s: %s", client_id, prompt)
 
-    if client_id not in active_chats:
-        print(f"Starting new chat session for {client_id}")
-        active_chats[client_id] = model.start_chat(history=[])
-    
-    chat_session = active_chats[client_id]
+    throttled = _throttle(client_id)
+    if throttled is not None:
+        return throttled
 
     try:
-        response = chat_session.send_message(prompt)
-        print(f"Gemini response for {client_id}: {response.text}")
-        return jsonify({"response": response.text})
+        if data.get('stateless'):
+            text = _generate_stateless(prompt, _pool_client(), _client_weight())
+        else:
+            with session_locks.hold(client_id, timeout=SESSION_LOCK_TIMEOUT):
+                text = _session_turn(client_id, prompt, _pool_client(), _client_weight())
+        logger.debug("Gemini response for %s: %s", client_id, text)
+        started = time.perf_counter()
+        response = jsonify({"response": text})
+        SERIALIZATION_SECONDS.observe(time.perf_counter() - started, route=_route_label())
+        return response
+    except LockTimeout:
+        return _session_busy_response()
+    except StaleSession:
+        return _session_conflict_response()
+    except PoolSaturated as e:
+        return _overloaded_response(e.retry_after)
+    except CircuitOpen as e:
+        return _overloaded_response(e.retry_after, f"Gemini API unavailable: {e}")
+    except UpstreamTimeout as e:
+        logger.warning("Gemini API call timed out: %s", e)
+        return jsonify({"error": f"Gemini API error: {e}"}), 504
     except Exception as e:
-        print(f"Error communicating with Gemini API: {e}")
+        logger.warning("Error communicating with Gemini API: %s", e)
         return jsonify({"error": f"Gemini API error: {str(e)}"}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream_handler():
+    """Relays the model's reply as server-sent events while it is generated.
+
+    Each partial chunk is sent as a `data: {"token": ...}` event, followed by a
+    final `done` event (or an `error` event if the upstream call fails).
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    data = request.get_json()
+    prompt = data.get('prompt')
+    client_id = _client_id()
+
+    if not prompt:
+        return jsonify({"error": "Missing 'prompt' in request"}), 400
+
+    logger.debug("Received streaming prompt from %s: %s", client_id, prompt)
+
+    throttled = _throttle(client_id)
+    if throttled is not None:
+        return throttled
+    # Reject up front while we can still send a proper status code
+    if upstream_pool.saturated():
+        return _overloaded_response(upstream_pool.retry_after())
+    pool_client, weight = _pool_client(), _client_weight()
+
+    def generate_stateless():
+        key = cache_key(model.model_name, prompt) if response_cache is not None else None
+        cached = response_cache.get(key) if key is not None else None
+        if cached is not None:
+            yield _sse_event({"token": cached})
+            yield _sse_event({"done": True}, event="done")
+            return
+        try:
+            chunks = []
+            start_stream = lambda: (chunk.text for chunk in model.generate_content(prompt, stream=True))
+            for text in upstream.stream(start_stream, pool_client, weight):
+                if text:
+                    chunks.append(text)
+                    yield _sse_event({"token": text})
+            if key is not None:
+                response_cache.put(key, "".join(chunks))
+            yield _sse_event({"done": True}, event="done")
+        except PoolSaturated as e:
+            yield _overloaded_event(e.retry_after)
+        except CircuitOpen as e:
+            yield _overloaded_event(e.retry_after, f"Gemini API unavailable: {e}")
+        except Exception as e:
+            logger.warning("Error streaming from Gemini API: %s", e)
+            yield _sse_event({"error": f"Gemini API error: {str(e)}"}, event="error")
+
+    def generate():
+        # The session lock is held for as long as the reply is being streamed
+        try:
+            with session_locks.hold(client_id, timeout=SESSION_LOCK_TIMEOUT):
+                chat_session = session_store.get(client_id)
+                key = _session_cache_key(chat_session, prompt)
+                cached = response_cache.get(key) if key is not None else None
+                if cached is not None:
+                    append_exchange(chat_session, prompt, cached)
+                    try:
+                        session_store.record_turn(client_id)
+                    except StaleSession:
+                        yield _sse_event({"error": SESSION_CONFLICT_MESSAGE}, event="error")
+                        return
+                    yield _sse_event({"token": cached})
+                    yield _sse_event({"done": True}, event="done")
+                    return
+                history = list(chat_session.history)
+                attempt_sessions = []
+
+                def start_stream():
+                    # Each attempt streams into its own copy, so a failed stream leaves the session untouched
+                    attempt_session = model.start_chat(history=history)
+                    attempt_sessions.append(attempt_session)
+                    return (chunk.text for chunk in attempt_session.send_message(prompt, stream=True))
+
+                try:
+                    chunks = []
+                    for text in upstream.stream(start_stream, pool_client, weight):
+                        if text:
+                            chunks.append(text)
+                            yield _sse_event({"token": text})
+                    chat_session.history = attempt_sessions[-1].history
+                    if key is not None:
+                        response_cache.put(key, "".join(chunks))
+                    session_store.record_turn(client_id)
+                    yield _sse_event({"done": True}, event="done")
+                    logger.debug("Finished streaming response for %s", client_id)
+                except StaleSession:
+                    # The reply has already been sent, so it can't be answered again; it isn't stored
+                    yield _sse_event({"error": SESSION_CONFLICT_MESSAGE}, event="error")
+                except PoolSaturated as e:
+                    yield _overloaded_event(e.retry_after)
+                except CircuitOpen as e:
+                    yield _overloaded_event(e.retry_after, f"Gemini API unavailable: {e}")
+                except Exception as e:
+                    logger.warning("Error streaming from Gemini API: %s", e)
+                    yield _sse_event({"error": f"Gemini API error: {str(e)}"}, event="error")
+        except LockTimeout:
+            yield _sse_event({"error": "Another request for this chat session is still in progress."}, event="error")
+
+    return Response(
+        stream_with_context(generate_stateless() if data.get('stateless') else generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _batch_result(index, fn, prompt):
+    """Runs one prompt of a batch, turning failures into a per-prompt error entry."""
+    try:
+        return {"index": index, "response": fn(prompt)}
+    except StaleSession:
+        return {"index": index, "error": SESSION_CONFLICT_MESSAGE}
+    except PoolSaturated as e:
+        return {"index": index, "error": "Server is overloaded, please retry shortly.", "retry_after": e.retry_after}
+    except CircuitOpen as e:
+        return {"index": index, "error": f"Gemini API unavailable: {e}", "retry_after": e.retry_after}
+    except Exception as e:
+        logger.warning("Error communicating with Gemini API: %s", e)
+        return {"index": index, "error": f"Gemini API error: {str(e)}"}
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch_handler():
+    """Answers a list of prompts in one request.
+
+    Stateless prompts are sent upstream concurrently; prompts for the client's
+    session run one after another, since each builds on the previous reply.
+    Results come back in order as {"responses": [...]}, or with "stream": true
+    as newline-delimited JSON, one line per prompt as soon as it finishes.
+    Every result carries the `index` of its prompt, and either `response` or `error`.
+    Each prompt costs one rate-limit token, even when a batch is larger than the burst.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    data = request.get_json()
+    prompts = data.get('prompts')
+    client_id = _client_id()
+
+    if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p for p in prompts):
+        return jsonify({"error": "'prompts' must be a non-empty list of prompts"}), 400
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        return jsonify({"error": f"At most {BATCH_MAX_PROMPTS} prompts per batch"}), 400
+
+    logger.debug("Received batch of %d prompts from %s", len(prompts), client_id)
+
+    throttled = _throttle(client_id, cost=len(prompts))
+    if throttled is not None:
+        return throttled
+    if upstream_pool.saturated():
+        return _overloaded_response(upstream_pool.retry_after())
+    pool_client, weight = _pool_client(), _client_weight()
+
+    def run_stateless():
+        generate = lambda prompt: _generate_stateless(prompt, pool_client, weight)
+        # Threads of its own, so batches never wait behind each other outside the pool's fair queue
+        executor = ThreadPoolExecutor(max_workers=min(BATCH_MAX_CONCURRENCY, len(prompts)),
+                                      thread_name_prefix="batch")
+        futures = [executor.submit(_batch_result, i, generate, p) for i, p in enumerate(prompts)]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Stop prompts that haven't started if the client went away
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def session_results():
+        # Callers hold the session lock
+        turn = lambda prompt: _session_turn(client_id, prompt, pool_client, weight)
+        for index, prompt in enumerate(prompts):
+            result = _batch_result(index, turn, prompt)
+            yield result
+            if "error" in result:
+                # Later prompts would be answered without the context they expect
+                for skipped in range(index + 1, len(prompts)):
+                    yield {"index": skipped, "error": "Skipped because an earlier prompt failed."}
+                return
+
+    def stream_session():
+        try:
+            with session_locks.hold(client_id, timeout=SESSION_LOCK_TIMEOUT):
+                yield from session_results()
+        except LockTimeout:
+            for index in range(len(prompts)):
+                yield {"index": index, "error": "Another request for this chat session is still in progress."}
+
+    if data.get('stream'):
+        results = run_stateless() if data.get('stateless') else stream_session()
+        lines = (json_codec.dumps(result) + b"\n" for result in results)
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    if data.get('stateless'):
+        results = sorted(run_stateless(), key=lambda result: result["index"])
+    else:
+        try:
+            with session_locks.hold(client_id, timeout=SESSION_LOCK_TIMEOUT):
+                results = list(session_results())
+        except LockTimeout:
+            return _session_busy_response()
+    return jsonify({"responses": results})
+
+@app.errorhandler(InvalidSessionToken)
+def invalid_session_token_handler(e):
+    return jsonify({"error": f"{e} Request a new one from /session."}), 401
+
+@app.route('/session', methods=['POST'])
+def new_session_handler():
+    """Issues a token identifying a new conversation, to be sent back in the X-Session-Token header."""
+    if session_create_rate_limiter is not None:
+        wait = session_create_rate_limiter.acquire(request.remote_addr)
+        if wait:
+            return _too_many_requests_response(wait)
+    session_id, token = session_tokens.issue()
+    logger.info("Issued session %s to %s", session_id, request.remote_addr)
+    return jsonify({"session_token": token})
+
 @app.route('/reset_chat', methods=['POST'])
 def reset_chat_handler():
-    client_id = request.remote_addr
-    if client_id in active_chats:
-        del active_chats[client_id]
-        print(f"Chat session reset for {client_id}")
+    client_id = _client_id()
+    try:
+        with session_locks.hold(client_id, timeout=SESSION_LOCK_TIMEOUT):
+            existed = session_store.pop(client_id)
+    except LockTimeout:
+        return _session_busy_response()
+    if existed:
+        logger.info("Chat session reset for %s", client_id)
         return jsonify({"message": "Chat session reset successfully"}), 200
     return jsonify({"message": "No active chat session to reset"}), 200
 
-@app.route('/download_dependencies')
-def download_dependencies():
-    """Serves the universal requests_bundle.zip file."""
+@app.route('/healthz')
+def healthz_handler():
+    """Readiness check for load balancers; fails once a graceful shutdown has started."""
+    if serving.draining.is_set():
+        return jsonify({"status": "draining"}), 503
+    return jsonify({"status": "ok"})
+
+def _rate_limit_stats(limiter):
+    if limiter is None:
+        return None
+    return dict(limiter.stats(), most_throttled=limiter.throttled())
+
+@app.route('/stats')
+def stats_handler():
+    """Reports session store, upstream pool, request coalescing and response cache counters."""
+    return jsonify({
+        "process": {"pid": os.getpid(), "rss_bytes": _current_rss_bytes(), "json_codec": json_codec.NAME},
+        "sessions": session_store.stats(),
+        "coalescing": dict(stateless_flight.stats),
+        "upstream_pool": upstream_pool.stats(),
+        "upstream_resilience": upstream.stats(),
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+        "rate_limit": {
+            "sessions": _rate_limit_stats(session_rate_limiter),
+            "ips": _rate_limit_stats(ip_rate_limiter),
+            "session_creation": _rate_limit_stats(session_create_rate_limiter),
+        },
+    })
+
+
+# Everything not listed as a gauge only ever increases and is exported as a counter.
+# throttled_seconds is a gauge because it shrinks when idle clients' buckets are dropped.
+RATE_LIMIT_GAUGES = ("tracked_clients", "throttled_now", "throttled_seconds")
+metrics.register_stats("chat_sessions", session_store.stats, gauges=("active_sessions", "history_bytes"))
+metrics.register_stats("chat_upstream_pool", upstream_pool.stats,
+                       gauges=("in_flight", "queued", "queued_clients", "avg_call_seconds"))
+metrics.register_stats("chat_upstream", upstream.stats)
+metrics.register_stats("chat_coalescing", lambda: dict(stateless_flight.stats))
+metrics.register_stats("chat_response_cache", lambda: response_cache.stats() if response_cache is not None else None,
+                       gauges=("entries",))
+metrics.register_stats("chat_rate_limit_sessions", lambda: session_rate_limiter.stats() if session_rate_limiter else None,
+                       gauges=RATE_LIMIT_GAUGES)
+metrics.register_stats("chat_rate_limit_ips", lambda: ip_rate_limiter.stats() if ip_rate_limiter else None,
+                       gauges=RATE_LIMIT_GAUGES)
+metrics.register_stats("chat_rate_limit_session_creation",
+                       lambda: session_create_rate_limiter.stats() if session_create_rate_limiter else None,
+                       gauges=RATE_LIMIT_GAUGES)
+metrics.register_stats("chat_process", lambda: {"rss_bytes": _current_rss_bytes()}, gauges=("rss_bytes",))
+
+@app.route('/metrics')
+def metrics_handler():
+    """Prometheus scrape endpoint. With several workers, each scrape reports the worker that answered it."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Bundles are identified by their SHA-256, used as a strong ETag and published in the manifest
+bundle_digests = DigestCache()
+bundle_carve_lock = threading.Lock()
+
+@app.route('/dependencies_manifest')
+def dependencies_manifest():
+    """Lists the downloadable bundles with their size and SHA-256, for clients to verify downloads."""
+    static_dir = app.config['STATIC_DIR']
+    return jsonify({"files": bundle_digests.manifest(static_dir, bundle_names(static_dir))})
+
+@app.route('/bundles_index')
+def bundles_index():
+    """Serves the index j.py wrote for the bundles it built, to compare a server's files against a build."""
+    index = load_bundles_index(app.config['STATIC_DIR'])
+    if index is None:
+        return jsonify({"error": "No bundles index on server."}), 404
+    return jsonify(index)
+
+def _send_bundle(name):
+    """Sends a bundle from the static directory.
+
+    Supports If-None-Match (304 when the client already has this bundle) and
+    Range requests, so interrupted downloads can resume.
+    """
     try:
-        print(f"Serving requests_bundle.zip from {app.config['STATIC_DIR']}")
-        return send_from_directory(
+        digest, _ = bundle_digests.get(os.path.join(app.config['STATIC_DIR'], name))
+        logger.info("Serving %s from %s", name, app.config['STATIC_DIR'])
+        response = send_from_directory(
             app.config['STATIC_DIR'],
-            'requests_bundle.zip',
-            as_attachment=True
+            name,
+            as_attachment=True,
+            conditional=True,
+            etag=digest,
         )
+        # Clients may keep a copy but must check it is still current
+        response.cache_control.no_cache = True
+        return response
     except FileNotFoundError:
-        return jsonify({"error": "requests_bundle.zip not found on server."}), 404
+        return jsonify({"error": f"{name} not found on server."}), 404
+    except HTTPException:
+        # e.g. 416 for a Range past the end of the file
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-if __name__ == '__main__':
+@app.route('/download_dependencies')
+def download_dependencies():
+    """Serves the universal requests_bundle.zip file, with the libraries for every platform."""
+    return _send_bundle(UNIVERSAL_BUNDLE)
+
+@app.route('/download_dependencies/<platform>')
+def download_platform_dependencies(platform):
+    """Serves only the libraries for one platform (e.g. linux_x86_64), a fraction of the universal bundle.
+
+    If j.py's per-platform bundle isn't on the server, or belongs to a different
+    build than the universal bundle, it is cut out of the universal bundle.
+    """
+    if not PLATFORM_NAME.match(platform):
+        return jsonify({"error": f"Unknown platform '{platform}'."}), 404
+    name = platform_bundle_name(platform)
+    static_dir = app.config['STATIC_DIR']
+    try:
+        universal_digest, _ = bundle_digests.get(os.path.join(static_dir, UNIVERSAL_BUNDLE))
+    except FileNotFoundError:
+        # Nothing to cut it from; serve j.py's bundle if there is one
+        return _send_bundle(name)
+    if not _platform_bundle_current(name, universal_digest):
+        with bundle_carve_lock:
+            if not _platform_bundle_current(name, universal_digest):
+                if carve_platform_bundle(static_dir, platform, universal_digest) is None:
+                    return jsonify({"error": f"No bundle for platform '{platform}' on server."}), 404
+                logger.info("Created %s from %s", name, UNIVERSAL_BUNDLE)
+    return _send_bundle(name)
+
+def _platform_bundle_current(name, universal_digest):
+    """
+    True if a per-platform bundle exists and matches the universal bundle: either
+    j.py's bundles index lists both as built together, or it was cut from it.
+    """
+    static_dir = app.config['STATIC_DIR']
+    path = os.path.join(static_dir, name)
+    try:
+        digest, _ = bundle_digests.get(path)
+    except FileNotFoundError:
+        return False
+    index = load_bundles_index(static_dir)
+    if index is not None:
+        try:
+            built = {entry["file"]: entry["sha256"] for entry in index["platforms"].values()}
+            if index["universal"]["sha256"] == universal_digest and built.get(name) == digest:
+                return True
+        except (KeyError, TypeError, AttributeError):
+            logger.warning("Ignoring malformed bundles index in %s", static_dir)
+    return carved_from(path) == universal_digest
+
+def _close_resources():
+    """Flushes and closes persistent state before the process exits."""
+    if response_cache is not None:
+        response_cache.close()
+    session_store.backend.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini LAN chat server.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("dev", help="Run the single-threaded Flask development server (default)")
+    serve_parser = subparsers.add_parser("serve", help="Run the production server")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=_env_int("PORT", 5000))
+    serve_parser.add_argument("--workers", type=int, default=_env_int("SERVER_WORKERS", 1),
+                              help="Worker processes (requires SESSION_BACKEND=sqlite when > 1)")
+    serve_parser.add_argument("--threads", type=int, default=_env_int("SERVER_THREADS", 16),
+                              help="Request threads per worker")
+    serve_parser.add_argument("--keepalive", type=int, default=_env_int("SERVER_KEEPALIVE", 15),
+                              help="Seconds to keep idle client connections open")
+    serve_parser.add_argument("--graceful-timeout", type=int, default=_env_int("SERVER_GRACEFUL_TIMEOUT", 90),
+                              help="Seconds to let in-flight chats finish on shutdown")
+    args = parser.parse_args(argv)
+
     # Create the static files directory if it doesn't exist
     if not os.path.exists(app.config['STATIC_DIR']):
         os.makedirs(app.config['STATIC_DIR'])
 
-    print("Starting Flask server for Gemini AI...")
-    print(f"Make sure 'requests_bundle.zip' is in the '{app.config['STATIC_DIR']}' directory.")
-    app.run(host='0.0.0.0', port=5000) # Use debug=False in production
\ No newline at end of file
+    logger.info("Starting Flask server for Gemini AI...")
+    logger.info("Make sure 'requests_bundle.zip' is in the '%s' directory.", app.config['STATIC_DIR'])
+    # Hash the bundles now rather than on the first download
+    for name, info in bundle_digests.manifest(app.config['STATIC_DIR'], bundle_names(app.config['STATIC_DIR'])).items():
+        logger.info("%s: %d bytes, sha256 %s", name, info["size"], info["sha256"])
+
+    if args.command != "serve":
+        app.run(host='0.0.0.0', port=_env_int("PORT", 5000)) # Use debug=False in production
+        return
+
+    if args.workers > 1 and not session_store.backend.shared:
+        # Each worker would otherwise hold its own, diverging copy of every conversation
+        parser.error("--workers > 1 needs a shared session backend; set SESSION_BACKEND=sqlite.")
+    serving.serve(app, args.host, args.port, args.workers, args.threads,
+                  args.keepalive, args.graceful_timeout, on_exit=_close_resources)
+
+if __name__ == '__main__':
+    main()
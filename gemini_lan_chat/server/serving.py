@@ -0,0 +1,138 @@
+# serving.py
+import logging
+import signal
+import sys
+import threading
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+from werkzeug.wsgi import ClosingIterator
+
+logger = logging.getLogger(__name__)
+
+# Set once the server has been asked to stop; /healthz reports 503 from then on
+draining = threading.Event()
+
+
+class InFlightTracker:
+    """
+    WSGI middleware that counts requests until their response body is closed.
+
+    Streaming replies keep running after the view function returns, so the
+    count only drops once the last chunk has been sent (or the client left).
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self._count = 0
+        self._idle = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._idle:
+            self._count += 1
+        try:
+            result = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return ClosingIterator(result, self._done)
+
+    def _done(self):
+        with self._idle:
+            self._count -= 1
+            if self._count == 0:
+                self._idle.notify_all()
+
+    @property
+    def in_flight(self):
+        return self._count
+
+    def wait_idle(self, timeout):
+        """Blocks until no requests are in flight. Returns False if `timeout` expired first."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._count == 0, timeout=timeout)
+
+
+def run_threaded(app, host, port, keepalive, graceful_timeout, on_exit=None):
+    """
+    Serves `app` from a single process with Werkzeug's threaded server.
+
+    Used on platforms without Gunicorn (e.g. Windows). HTTP/1.1 is enabled so
+    clients can keep connections alive, and SIGINT/SIGTERM stop accepting new
+    connections, then wait up to `graceful_timeout` seconds for in-flight
+    chats to finish.
+    """
+    tracker = InFlightTracker(app.wsgi_app)
+    app.wsgi_app = tracker
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"
+        timeout = keepalive
+
+    server = make_server(host, port, app, threaded=True, request_handler=KeepAliveHandler)
+
+    def stop(signum, frame):
+        if draining.is_set():
+            return
+        logger.info("Received signal %s, draining %d in-flight requests...", signum, tracker.in_flight)
+        draining.set()
+        # shutdown() blocks until serve_forever() returns, so it can't run on the serving thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    logger.info("Serving on http://%s:%d (threaded, keep-alive %ds)", host, port, keepalive)
+    server.serve_forever()
+    if not tracker.wait_idle(graceful_timeout):
+        logger.warning("Graceful timeout expired with %d requests still in flight.", tracker.in_flight)
+    server.server_close()
+    if on_exit is not None:
+        on_exit()
+
+
+def run_gunicorn(app, host, port, workers, threads, keepalive, graceful_timeout, on_exit=None):
+    """
+    Serves `app` with Gunicorn's threaded workers.
+
+    On SIGTERM Gunicorn stops accepting connections and gives each worker
+    `graceful_timeout` seconds to finish in-flight requests before exiting.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    def worker_exit(server, worker):
+        if on_exit is not None:
+            on_exit()
+
+    class StandaloneApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", threads)
+            self.cfg.set("keepalive", keepalive)
+            self.cfg.set("graceful_timeout", graceful_timeout)
+            # Streaming replies can legitimately take longer than Gunicorn's 30s default
+            self.cfg.set("timeout", max(120, graceful_timeout))
+            self.cfg.set("worker_exit", worker_exit)
+
+        def load(self):
+            return app
+
+    logger.info("Serving on http://%s:%d with Gunicorn (%d workers x %d threads)", host, port, workers, threads)
+    StandaloneApplication().run()
+
+
+def serve(app, host, port, workers, threads, keepalive, graceful_timeout, on_exit=None):
+    """Runs the production server, preferring Gunicorn when it is installed."""
+    try:
+        import gunicorn  # noqa: F401
+        have_gunicorn = sys.platform != "win32"
+    except ImportError:
+        have_gunicorn = False
+
+    if have_gunicorn:
+        run_gunicorn(app, host, port, workers, threads, keepalive, graceful_timeout, on_exit)
+        return
+    if workers > 1:
+        logger.warning("Gunicorn is not installed, so only one worker process can be used.")
+    run_threaded(app, host, port, keepalive, graceful_timeout, on_exit)
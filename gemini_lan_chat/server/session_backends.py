@@ -0,0 +1,258 @@
+# session_backends.py
+import random
+import sqlite3
+import threading
+import time
+import zlib
+
+ROLES = ("user", "model")
+# Turns longer than this are stored zlib-compressed
+COMPRESS_THRESHOLD = 256
+
+
+def history_to_turns(history):
+    """Converts a ChatSession history into a list of (role, text) tuples."""
+    turns = []
+    for content in history:
+        if isinstance(content, dict):
+            role, parts = content.get('role', 'user'), content.get('parts', [])
+        else:
+            role, parts = content.role or 'user', content.parts
+        text = "".join(part if isinstance(part, str) else getattr(part, 'text', '') for part in parts)
+        turns.append((role, text))
+    return turns
+
+
+def turns_to_history(turns):
+    """Converts (role, text) tuples back into the history format accepted by start_chat."""
+    return [{"role": role, "parts": [text]} for role, text in turns]
+
+
+def append_exchange(chat, prompt, reply):
+    """Records a prompt and its reply in a ChatSession's history without calling the model."""
+    chat.history = list(chat.history) + [
+        {"role": "user", "parts": [prompt]},
+        {"role": "model", "parts": [reply]},
+    ]
+
+
+class StaleSession(Exception):
+    """Raised when a session was written by another worker since the version a write expected."""
+
+
+class SessionBackend:
+    """
+    Interface for storing chat histories outside the serving process.
+
+    Every write gives the session a new version tag, which lets the in-memory
+    SessionStore detect that another worker has changed a session it has cached.
+    Writes given an `expected_version` are compare-and-swap: they raise
+    StaleSession instead of writing if the stored version differs (a session
+    that isn't stored counts as version 0).
+    """
+
+    # Whether other processes can write to the same sessions
+    shared = False
+
+    def load(self, session_id):
+        """Returns (version, turns) for a stored session, or None."""
+        raise NotImplementedError
+
+    def version(self, session_id):
+        """Returns the current version tag of a stored session, or None."""
+        raise NotImplementedError
+
+    def append(self, session_id, turns, keep_last=None, expected_version=None):
+        """Appends turns, optionally dropping all but the last `keep_last`. Returns the new version tag."""
+        raise NotImplementedError
+
+    def replace(self, session_id, turns, expected_version=None):
+        """Overwrites the stored history of a session. Returns the new version tag."""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """Removes a stored session. Returns True if one existed."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemorySessionBackend(SessionBackend):
+    """
+    Keeps nothing beyond what the SessionStore already holds in memory.
+
+    This is the original behaviour: sessions are lost on eviction or restart,
+    and each worker process has its own independent set of conversations.
+    """
+
+    def load(self, session_id):
+        return None
+
+    def version(self, session_id):
+        return None
+
+    def append(self, session_id, turns, keep_last=None, expected_version=None):
+        return 0
+
+    def replace(self, session_id, turns, expected_version=None):
+        return 0
+
+    def delete(self, session_id):
+        return False
+
+
+class SqliteSessionBackend(SessionBackend):
+    """
+    Stores chat histories in a SQLite database shared by all worker processes.
+
+    The database runs in WAL mode so readers in other workers never block the
+    writer, and each completed exchange is written in a single transaction.
+    Roles are stored as small integers and long turns are zlib-compressed.
+    """
+
+    shared = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            next_seq INTEGER NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS turns (
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            role INTEGER NOT NULL,
+            compressed INTEGER NOT NULL,
+            body BLOB NOT NULL,
+            PRIMARY KEY (session_id, seq)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        # sqlite3 connections can't be shared between threads, so each thread opens its own
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+        # Don't keep this connection around: the process may fork into workers next
+        self.close()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _encode(role, text):
+        body = text.encode('utf-8')
+        if len(body) > COMPRESS_THRESHOLD:
+            return ROLES.index(role) if role in ROLES else 0, 1, zlib.compress(body)
+        return ROLES.index(role) if role in ROLES else 0, 0, body
+
+    @staticmethod
+    def _decode(role, compressed, body):
+        if compressed:
+            body = zlib.decompress(body)
+        return ROLES[role], bytes(body).decode('utf-8')
+
+    def load(self, session_id):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        rows = conn.execute(
+            "SELECT role, compressed, body FROM turns WHERE session_id = ? ORDER BY seq",
+            (session_id,)
+        ).fetchall()
+        return row[0], [self._decode(*r) for r in rows]
+
+    def version(self, session_id):
+        row = self._conn().execute(
+            "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, session_id, turns, replace=False, keep_last=None, expected_version=None):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT version, next_seq FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            # The write lock is held from here to COMMIT, so checking the version is race-free
+            if expected_version is not None and (row[0] if row else 0) != expected_version:
+                raise StaleSession(f"Session {session_id!r} was changed by another worker")
+            next_seq = row[1] if row else 0
+            # Random tags rather than a counter, so a deleted and recreated session never reuses
+            # one; 0 is reserved for sessions that aren't stored
+            version = random.getrandbits(62) or 1
+            if replace:
+                conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            conn.executemany(
+                "INSERT INTO turns (session_id, seq, role, compressed, body) VALUES (?, ?, ?, ?, ?)",
+                [(session_id, next_seq + i, *self._encode(role, text)) for i, (role, text) in enumerate(turns)]
+            )
+            next_seq += len(turns)
+            if keep_last is not None:
+                conn.execute(
+                    "DELETE FROM turns WHERE session_id = ? AND seq < ?",
+                    (session_id, next_seq - keep_last)
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, version, next_seq, updated) VALUES (?, ?, ?, ?)",
+                (session_id, version, next_seq, time.time())
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+    def append(self, session_id, turns, keep_last=None, expected_version=None):
+        return self._write(session_id, turns, keep_last=keep_last, expected_version=expected_version)
+
+    def replace(self, session_id, turns, expected_version=None):
+        return self._write(session_id, turns, replace=True, expected_version=expected_version)
+
+    def delete(self, session_id):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            deleted = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted > 0
+
+    def purge_idle(self, max_age):
+        """Deletes sessions that have not been written to for `max_age` seconds."""
+        cutoff = time.time() - max_age
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM turns WHERE session_id IN (SELECT session_id FROM sessions WHERE updated < ?)",
+                (cutoff,)
+            )
+            purged = conn.execute("DELETE FROM sessions WHERE updated < ?", (cutoff,)).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return purged
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
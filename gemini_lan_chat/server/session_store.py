@@ -0,0 +1,275 @@
+# session_store.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from history import HistoryPolicy, history_text_size
+from session_backends import MemorySessionBackend, StaleSession, history_to_turns, turns_to_history
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ('chat', 'last_used', 'size', 'version', 'persisted', 'pending_summary')
+
+    def __init__(self, chat, now, version=0):
+        self.chat = chat
+        self.last_used = now
+        self.size = history_text_size(chat.history)
+        # Backend version this entry was loaded at, and how many history items are stored
+        self.version = version
+        self.persisted = len(chat.history)
+        # Future for a summary being made in the background, applied on the next get()
+        self.pending_summary = None
+
+
+class SessionStore:
+    """
+    Keeps active ChatSessions in memory with LRU and idle-TTL eviction.
+
+    Sessions are ordered by last use, so both the entry/memory caps and the
+    idle TTL only ever need to look at the oldest end of the dict.
+
+    `factory(history)` builds a ChatSession. When a `backend` is given, every
+    completed turn is written through to it and sessions missing from memory
+    (after an eviction, a restart, or on another worker) are lazily rebuilt
+    from the stored history on their next request.
+
+    After each turn the session's history is compacted according to
+    `history_policy` (by default, only the last 50 exchanges are kept). Summaries
+    are made on a background thread so they never delay a reply, and applied
+    when the session is next used.
+    """
+
+    def __init__(self, factory, max_entries=500, idle_ttl=1800, max_bytes=None,
+                 history_policy=None, backend=None, clock=time.monotonic):
+        self._factory = factory
+        self.backend = backend or MemorySessionBackend()
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.history_policy = history_policy or HistoryPolicy()
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions_lru": 0,
+            "evictions_ttl": 0,
+            "evictions_memory": 0,
+            "history_trims": 0,
+            "history_summaries": 0,
+            "history_summary_fallbacks": 0,
+            "rehydrations": 0,
+            "stale_reloads": 0,
+            "write_conflicts": 0,
+        }
+
+    def get(self, session_id):
+        """
+        Returns the ChatSession for `session_id`, creating or loading one on a miss.
+
+        Callers must hold the session's lock, as a summary started after the
+        previous turn is applied here.
+        """
+        with self._lock:
+            now = self._clock()
+            self._expire_idle(now)
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                entry.last_used = now
+                self._entries.move_to_end(session_id)
+
+        # Another worker may have written to this session since we cached it (a session
+        # that was never stored counts as version 0, like a new entry)
+        if entry is not None and (not self.backend.shared
+                                  or (self.backend.version(session_id) or 0) == entry.version):
+            if entry.pending_summary is None or self._finish_summary(session_id, entry):
+                with self._lock:
+                    self._stats["hits"] += 1
+                return entry.chat
+
+        loaded = self.backend.load(session_id)
+        if loaded is None:
+            version, chat = 0, self._factory([])
+        else:
+            version, turns = loaded
+            chat = self._factory(turns_to_history(turns))
+
+        with self._lock:
+            if entry is not None:
+                self._stats["stale_reloads"] += 1
+            elif loaded is not None:
+                self._stats["rehydrations"] += 1
+            else:
+                self._stats["misses"] += 1
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self._total_bytes -= old.size
+            entry = _Entry(chat, now, version)
+            self._entries[session_id] = entry
+            self._total_bytes += entry.size
+            self._enforce_caps()
+            return entry.chat
+
+    def record_turn(self, session_id):
+        """
+        Compacts and persists the session's history after a completed turn.
+
+        Callers must hold the session's lock, so nothing else touches this
+        session's history meanwhile. With the "summarize" strategy, the summary
+        is only started here; the turn is stored as is and the summary replaces
+        the older exchanges on the session's next get().
+
+        Raises StaleSession if another worker wrote the session after it was
+        loaded, i.e. the turn was answered without that worker's exchanges.
+        The turn is then not stored, and the session is reloaded on its next get().
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        history = entry.chat.history
+        new_turns = history_to_turns(history[entry.persisted:])
+        compacted = None
+        if self.history_policy.over_limit(history):
+            if self.history_policy.summarizes:
+                if entry.pending_summary is None:
+                    entry.pending_summary = self._start_summary(history)
+            else:
+                compacted = self.history_policy.compact(history)
+                entry.chat.history = compacted
+                history = entry.chat.history
+        entry.persisted = len(history)
+
+        with self._lock:
+            if compacted is not None:
+                self._stats["history_trims"] += 1
+            self._resize(session_id, entry)
+
+        keep_last = len(history) if compacted is not None else None
+        self._store(session_id, entry, lambda version: self.backend.append(
+            session_id, new_turns, keep_last=keep_last, expected_version=version))
+
+    def _start_summary(self, history):
+        future = Future()
+        history = list(history)
+
+        def run():
+            try:
+                future.set_result(self.history_policy.summarize(history))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="history-summary", daemon=True).start()
+        return future
+
+    def _finish_summary(self, session_id, entry):
+        """
+        Applies the summary started after the session's last turn, waiting for
+        it up to the policy's summary_wait, or drops older exchanges instead.
+
+        Returns False if another worker wrote the session in the meantime.
+        """
+        future, entry.pending_summary = entry.pending_summary, None
+        history = entry.chat.history
+        summarized = None
+        try:
+            summarized = future.result(timeout=self.history_policy.summary_wait)
+        except FutureTimeout:
+            logger.info("History summary for session %s isn't ready, dropping older turns instead", session_id)
+        except Exception as e:
+            logger.warning("Summarizing history failed, dropping older turns instead: %s", e)
+        if summarized is not None:
+            entry.chat.history = self.history_policy.apply_summary(history, summarized)
+        else:
+            compacted = self.history_policy.compact(history)
+            if compacted is None:
+                return True
+            entry.chat.history = compacted
+        history = entry.chat.history
+        entry.persisted = len(history)
+
+        with self._lock:
+            if summarized is not None:
+                self._stats["history_summaries"] += 1
+            else:
+                self._stats["history_trims"] += 1
+                self._stats["history_summary_fallbacks"] += 1
+            self._resize(session_id, entry)
+
+        try:
+            if summarized is not None:
+                self._store(session_id, entry, lambda version: self.backend.replace(
+                    session_id, history_to_turns(history), expected_version=version))
+            else:
+                self._store(session_id, entry, lambda version: self.backend.append(
+                    session_id, [], keep_last=len(history), expected_version=version))
+        except StaleSession:
+            return False
+        return True
+
+    def _store(self, session_id, entry, write):
+        """Runs `write(expected_version)` and records the entry's new version, dropping the entry on a conflict."""
+        try:
+            version = write(entry.version)
+        except StaleSession:
+            with self._lock:
+                self._stats["write_conflicts"] += 1
+                if self._entries.get(session_id) is entry:
+                    del self._entries[session_id]
+                    self._total_bytes -= entry.size
+            raise
+        with self._lock:
+            entry.version = version
+
+    def _resize(self, session_id, entry):
+        # Called with self._lock held, after the entry's history changed
+        if self._entries.get(session_id) is entry:
+            self._total_bytes -= entry.size
+            entry.size = history_text_size(entry.chat.history)
+            self._total_bytes += entry.size
+            self._enforce_caps()
+
+    def pop(self, session_id):
+        """Removes a session from memory and the backend. Returns True if one existed."""
+        deleted = self.backend.delete(session_id)
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                return deleted
+            self._total_bytes -= entry.size
+            return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, active_sessions=len(self._entries),
+                        history_bytes=self._total_bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict_oldest(self, reason):
+        _, entry = self._entries.popitem(last=False)
+        self._total_bytes -= entry.size
+        self._stats[reason] += 1
+
+    def _expire_idle(self, now):
+        if not self.idle_ttl:
+            return
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if now - oldest.last_used < self.idle_ttl:
+                break
+            self._evict_oldest("evictions_ttl")
+
+    def _enforce_caps(self):
+        # Never evict the most recently used session, it is the one being served
+        while self.max_entries and len(self._entries) > self.max_entries:
+            self._evict_oldest("evictions_lru")
+        while self.max_bytes and self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            self._evict_oldest("evictions_memory")
@@ -0,0 +1,44 @@
+# session_tokens.py
+import base64
+import hashlib
+import hmac
+import secrets
+
+
+class InvalidSessionToken(Exception):
+    """Raised when a session token is malformed or its signature doesn't match."""
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+class SessionTokens:
+    """
+    Issues and checks signed session tokens of the form "<session id>.<signature>".
+
+    The session id is random and the signature is an HMAC-SHA256 of it under
+    `secret`, so a token is validated with one hash and a constant-time compare,
+    without looking anything up. Tokens stay valid for as long as the secret
+    does; every process serving the same clients needs the same secret.
+    """
+
+    def __init__(self, secret):
+        self._secret = secret.encode("utf-8") if isinstance(secret, str) else secret
+
+    def _sign(self, session_id):
+        return _b64(hmac.new(self._secret, session_id.encode("ascii"), hashlib.sha256).digest()[:16])
+
+    def issue(self):
+        """Returns (session_id, token) for a new session."""
+        session_id = secrets.token_urlsafe(16)
+        return session_id, f"{session_id}.{self._sign(session_id)}"
+
+    def verify(self, token):
+        """Returns the session id a token was issued for, or raises InvalidSessionToken."""
+        session_id, _, signature = token.strip().partition(".")
+        if not session_id or not signature or not token.isascii():
+            raise InvalidSessionToken("Malformed session token.")
+        if not hmac.compare_digest(signature, self._sign(session_id)):
+            raise InvalidSessionToken("Session token signature does not match.")
+        return session_id
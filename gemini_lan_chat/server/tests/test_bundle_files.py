@@ -0,0 +1,41 @@
+# test_bundle_files.py
+import os
+import stat
+import zipfile
+
+import pytest
+
+from bundle_files import UNIVERSAL_BUNDLE, carve_platform_bundle, carved_from, sha256_file
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    with zipfile.ZipFile(tmp_path / UNIVERSAL_BUNDLE, 'w') as bundle:
+        bundle.writestr('linux_x86_64/requests/__init__.py', 'x = 1\n')
+        bundle.writestr('windows_amd64/requests/__init__.py', 'x = 2\n')
+    return tmp_path
+
+
+def test_carved_bundle_holds_only_its_platform_and_records_its_source(static_dir):
+    source = sha256_file(static_dir / UNIVERSAL_BUNDLE)
+    name = carve_platform_bundle(str(static_dir), 'linux_x86_64', source)
+    with zipfile.ZipFile(static_dir / name) as bundle:
+        assert bundle.namelist() == ['linux_x86_64/requests/__init__.py']
+    assert carved_from(str(static_dir / name)) == source
+
+
+def test_carved_bundle_gets_the_usual_file_mode_not_mkstemps(static_dir):
+    name = carve_platform_bundle(str(static_dir), 'linux_x86_64')
+    umask = os.umask(0)
+    os.umask(umask)
+    assert stat.S_IMODE(os.stat(static_dir / name).st_mode) == 0o644 & ~umask
+
+
+def test_unknown_platform_is_not_carved(static_dir):
+    assert carve_platform_bundle(str(static_dir), 'plan9_mips') is None
+    assert sorted(os.listdir(static_dir)) == [UNIVERSAL_BUNDLE]
+
+
+def test_bundles_not_cut_by_the_server_have_no_source(static_dir):
+    assert carved_from(str(static_dir / UNIVERSAL_BUNDLE)) is None
+    assert carved_from(str(static_dir / 'missing.zip')) is None
@@ -0,0 +1,47 @@
+# test_client_imports.py
+import json
+import os
+import subprocess
+import sys
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                          "client", "client_files")
+
+# Runs in a fresh interpreter, so nothing this test process imported can leak in
+PROBE = """
+import json, sys
+import client
+before = sorted(m for m in ("requests", "urllib3") if m in sys.modules)
+client.load_requests()
+after = sorted(m for m in ("requests", "urllib3") if m in sys.modules)
+decoded = client.loads(b'{"reply": "hi"}')
+try:
+    import orjson
+    decoders = {orjson.loads: "orjson", json.loads: "json"}
+except ImportError:
+    decoders = {json.loads: "json"}
+print(json.dumps({
+    "before": before,
+    "after": after,
+    "decoded": decoded,
+    "decoder": decoders.get(client.loads),
+}))
+"""
+
+
+def run_probe():
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=CLIENT_DIR,
+                            capture_output=True, text=True, timeout=60, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_client_defers_requests_until_the_first_http_call():
+    probe = run_probe()
+    assert probe["before"] == []
+    assert probe["after"] == ["requests", "urllib3"]
+
+
+def test_loads_rebinds_itself_to_a_json_decoder():
+    probe = run_probe()
+    assert probe["decoded"] == {"reply": "hi"}
+    assert probe["decoder"] in ("orjson", "json")
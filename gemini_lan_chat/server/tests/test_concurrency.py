@@ -0,0 +1,102 @@
+# test_concurrency.py
+import threading
+import time
+
+import pytest
+
+from concurrency import FairQueue, PoolSaturated, UpstreamPool, UpstreamTimeout
+
+
+@pytest.fixture
+def release():
+    # Set at teardown so blocked pool threads never outlive the test
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def drain(queue):
+    return [queue.popleft() for _ in range(len(queue))]
+
+
+def test_fair_queue_takes_turns_across_clients():
+    queue = FairQueue()
+    for i in range(4):
+        queue.append("busy", f"busy{i}")
+    queue.append("quiet", "quiet0")
+    assert drain(queue) == ["busy0", "quiet0", "busy1", "busy2", "busy3"]
+    with pytest.raises(IndexError):
+        queue.popleft()
+
+
+def test_fair_queue_serves_clients_in_proportion_to_weight():
+    queue = FairQueue()
+    for i in range(6):
+        queue.append("teacher", f"t{i}", weight=3)
+        queue.append("student", f"s{i}")
+    assert drain(queue)[:8] == ["t0", "t1", "t2", "s0", "t3", "t4", "t5", "s1"]
+    assert queue.clients() == 0
+
+
+def hold_slot(pool, release):
+    """Occupies the pool's only thread until `release` is set."""
+    running = threading.Event()
+
+    def blocked():
+        running.set()
+        release.wait(5)
+        return "slow"
+
+    future = pool.submit(blocked, client="slow")
+    assert running.wait(1)
+    return future
+
+
+def test_queued_call_is_rejected_after_queue_timeout_not_after_the_running_call(release):
+    pool = UpstreamPool(max_in_flight=1, queue_timeout=0.2)
+    hold_slot(pool, release)
+    ran = threading.Event()
+
+    started = time.monotonic()
+    with pytest.raises(PoolSaturated):
+        pool.run(ran.set, client="other")
+    assert time.monotonic() - started < 1
+    assert pool.stats()["rejected_timeout"] == 1
+
+    # The rejected call was cancelled, so it never runs once the thread frees up
+    release.set()
+    assert pool.run(lambda: "next") == "next"
+    assert not ran.is_set()
+
+
+def test_queued_stream_is_rejected_after_queue_timeout(release):
+    pool = UpstreamPool(max_in_flight=1, queue_timeout=0.2)
+    hold_slot(pool, release)
+    with pytest.raises(PoolSaturated):
+        list(pool.stream(lambda: iter("abc"), client="other"))
+
+
+def test_started_call_gets_call_timeout(release):
+    pool = UpstreamPool(max_in_flight=1, queue_timeout=5, call_timeout=0.2)
+    started = time.monotonic()
+    with pytest.raises(UpstreamTimeout):
+        pool.run(lambda: release.wait(5))
+    assert time.monotonic() - started < 1
+    assert pool.stats()["call_timeouts"] == 1
+
+
+def test_calls_within_their_deadlines_succeed():
+    pool = UpstreamPool(max_in_flight=1, queue_timeout=1, call_timeout=1)
+    assert pool.run(lambda: "reply") == "reply"
+    assert list(pool.stream(lambda: iter("abc"))) == ["a", "b", "c"]
+
+
+def test_queued_calls_are_capped_per_client(release):
+    pool = UpstreamPool(max_in_flight=1, max_queue=10, max_queue_per_client=2)
+    hold_slot(pool, release)
+    for _ in range(2):
+        pool.submit(lambda: None, client="10.0.0.5")
+    with pytest.raises(PoolSaturated):
+        pool.submit(lambda: None, client="10.0.0.5")
+    pool.submit(lambda: None, client="10.0.0.6")
+    assert pool.stats()["rejected_client_full"] == 1
@@ -0,0 +1,24 @@
+# test_metrics.py
+from metrics import Registry
+
+
+def test_stats_are_exported_as_counters_unless_listed_as_gauges():
+    registry = Registry()
+    registry.register_stats("chat_sessions", lambda: {"hits": 3, "active_sessions": 2,
+                                                      "breaker": {"opened": 1, "state": "closed"}},
+                            gauges=("active_sessions",))
+    lines = registry.render().splitlines()
+    assert lines == [
+        "# TYPE chat_sessions_hits_total counter",
+        "chat_sessions_hits_total 3",
+        "# TYPE chat_sessions_active_sessions gauge",
+        "chat_sessions_active_sessions 2",
+        "# TYPE chat_sessions_breaker_opened_total counter",
+        "chat_sessions_breaker_opened_total 1",
+    ]
+
+
+def test_missing_stats_source_is_skipped():
+    registry = Registry()
+    registry.register_stats("chat_response_cache", lambda: None)
+    assert registry.render() == "\n"
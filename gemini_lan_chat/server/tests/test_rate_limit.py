@@ -0,0 +1,59 @@
+# test_rate_limit.py
+import pytest
+
+from conftest import FakeClock
+from rate_limit import RateLimiter
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_bucket_refills_at_rate_up_to_burst(clock):
+    limiter = RateLimiter(rate=1, burst=3, clock=clock)
+    for _ in range(3):
+        assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == pytest.approx(1)
+    clock.advance(1)
+    assert limiter.acquire("a") == 0
+    # Idle time beyond a full bucket earns nothing extra
+    clock.advance(100)
+    for _ in range(3):
+        assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") > 0
+    assert limiter.stats()["rejected"] == 2
+
+
+def test_keys_have_separate_buckets(clock):
+    limiter = RateLimiter(rate=1, burst=1, clock=clock)
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("b") == 0
+    assert limiter.acquire("a") > 0
+
+
+def test_refund_gives_tokens_back_up_to_burst(clock):
+    limiter = RateLimiter(rate=1, burst=3, clock=clock)
+    assert limiter.acquire("a", cost=2) == 0
+    limiter.refund("a", cost=2)
+    assert limiter.acquire("a", cost=3) == 0
+    limiter.refund("a", cost=10)
+    assert limiter.acquire("a", cost=3) == 0
+    assert limiter.acquire("a") > 0
+
+
+def test_cost_above_burst_is_charged_in_full(clock):
+    limiter = RateLimiter(rate=1, burst=5, clock=clock)
+    assert limiter.acquire("a", cost=64) == 0
+    # The bucket is 59 tokens in debt and only full again once it has been paid off
+    assert limiter.acquire("a") == pytest.approx(60)
+    assert limiter.acquire("a", cost=64) == pytest.approx(64)
+    clock.advance(60)
+    assert limiter.acquire("a") == 0
+
+
+def test_refunded_large_cost_restores_a_full_bucket(clock):
+    limiter = RateLimiter(rate=1, burst=5, clock=clock)
+    assert limiter.acquire("a", cost=64) == 0
+    limiter.refund("a", cost=64)
+    assert limiter.acquire("a", cost=5) == 0
@@ -0,0 +1,103 @@
+# test_resilience.py
+import pytest
+
+from concurrency import UpstreamPool
+from conftest import FakeClock
+from resilience import CircuitBreaker, CircuitOpen, ResilientUpstream
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def failing(code):
+    def fn():
+        raise ApiError(code)
+    return fn
+
+
+def make_breaker(clock):
+    return CircuitBreaker(window=4, failure_ratio=0.5, min_calls=4, cooldown=10, clock=clock)
+
+
+def test_breaker_opens_once_enough_recent_calls_failed():
+    breaker = make_breaker(FakeClock())
+    for success in (True, False, True):
+        breaker.allow()
+        breaker.record(success)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen) as excinfo:
+        breaker.allow()
+    assert excinfo.value.retry_after == 10
+
+
+def test_breaker_lets_one_trial_through_after_cooldown_and_closes_on_success():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record(False)
+    clock.advance(10)
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only the one trial call while it is outstanding
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+
+
+def test_failed_trial_reopens_the_breaker():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record(False)
+    clock.advance(10)
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["opened"] == 2
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+
+
+def test_unrecorded_trial_expires_after_cooldown():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record(False)
+    clock.advance(10)
+    breaker.allow()
+    clock.advance(11)
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def make_upstream(breaker):
+    return ResilientUpstream(UpstreamPool(max_in_flight=1), breaker, max_retries=1, sleep=lambda s: None)
+
+
+def test_client_errors_do_not_open_the_breaker():
+    breaker = make_breaker(FakeClock())
+    upstream = make_upstream(breaker)
+    for _ in range(6):
+        with pytest.raises(ApiError):
+            upstream.call(failing(400))
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert upstream.stats()["retries"] == 0
+
+
+def test_transient_errors_are_retried_and_open_the_breaker():
+    breaker = make_breaker(FakeClock())
+    upstream = make_upstream(breaker)
+    for _ in range(2):
+        with pytest.raises(ApiError):
+            upstream.call(failing(503))
+    assert upstream.stats()["retries"] == 2
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        upstream.call(lambda: "reply")
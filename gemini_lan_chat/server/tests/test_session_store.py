@@ -0,0 +1,161 @@
+# test_session_store.py
+import threading
+
+import pytest
+
+from conftest import FakeClock
+from history import SUMMARY_PREFIX, HistoryPolicy
+from session_backends import SqliteSessionBackend, StaleSession, append_exchange
+from session_store import SessionStore
+
+
+class FakeChat:
+    def __init__(self, history):
+        self.history = list(history)
+
+
+def make_store(**kwargs):
+    kwargs.setdefault("clock", FakeClock())
+    return SessionStore(factory=FakeChat, **kwargs)
+
+
+def turn(store, session_id, prompt, reply):
+    append_exchange(store.get(session_id), prompt, reply)
+    store.record_turn(session_id)
+
+
+def texts(chat):
+    return [content["parts"][0] for content in chat.history]
+
+
+def test_lru_eviction_keeps_most_recently_used():
+    store = make_store(max_entries=2)
+    store.get("a")
+    store.get("b")
+    store.get("a")
+    store.get("c")
+    assert store.stats()["evictions_lru"] == 1
+    store.get("a")
+    assert store.stats()["hits"] == 2
+    store.get("b")
+    assert store.stats()["misses"] == 4
+
+
+def test_idle_sessions_expire():
+    clock = FakeClock()
+    store = make_store(idle_ttl=60, clock=clock)
+    store.get("a")
+    clock.advance(30)
+    store.get("b")
+    clock.advance(31)
+    store.get("b")
+    assert store.stats()["evictions_ttl"] == 1
+    assert len(store) == 1
+
+
+def test_memory_cap_evicts_oldest_but_never_the_current_session():
+    store = make_store(max_bytes=10)
+    turn(store, "a", "12345", "67890")
+    turn(store, "b", "12345", "67890")
+    assert store.stats()["evictions_memory"] == 1
+    turn(store, "b", "a much longer prompt", "and reply")
+    assert len(store) == 1
+    assert store.stats()["history_bytes"] > 10
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "sessions.db")
+
+
+def test_stale_session_is_reloaded_from_another_workers_write(db_path):
+    first = make_store(backend=SqliteSessionBackend(db_path))
+    second = make_store(backend=SqliteSessionBackend(db_path))
+    turn(first, "s", "Q1", "A1")
+    second.get("s")
+    turn(first, "s", "Q2", "A2")
+
+    assert texts(second.get("s")) == ["Q1", "A1", "Q2", "A2"]
+    assert second.stats()["stale_reloads"] == 1
+    assert second.stats()["rehydrations"] == 1
+
+
+def test_concurrent_turns_in_two_workers_conflict_instead_of_losing_context(db_path):
+    first = make_store(backend=SqliteSessionBackend(db_path))
+    second = make_store(backend=SqliteSessionBackend(db_path))
+    # Both workers load the empty session before either stores its turn
+    chat_first, chat_second = first.get("s"), second.get("s")
+    append_exchange(chat_first, "Q1", "A1")
+    append_exchange(chat_second, "Q2", "A2 (without Q1 in context)")
+    first.record_turn("s")
+
+    with pytest.raises(StaleSession):
+        second.record_turn("s")
+    assert second.stats()["write_conflicts"] == 1
+    # The conflicting turn was not stored, and the retry sees the first worker's exchange
+    assert texts(second.get("s")) == ["Q1", "A1"]
+    turn(second, "s", "Q2", "A2")
+    assert texts(first.get("s")) == ["Q1", "A1", "Q2", "A2"]
+
+
+def test_new_session_is_not_reloaded_before_its_first_write(db_path):
+    store = make_store(backend=SqliteSessionBackend(db_path))
+    chat = store.get("s")
+    assert store.get("s") is chat
+    assert store.stats()["stale_reloads"] == 0
+
+
+def summarizing_policy(summarizer, summary_wait=1.0):
+    return HistoryPolicy(max_turns=2, keep_turns=1, strategy="summarize", summarizer=summarizer,
+                         summary_wait=summary_wait)
+
+
+def test_summary_is_made_after_the_turn_and_applied_on_the_next_get(db_path):
+    release = threading.Event()
+
+    def summarizer(turns):
+        release.wait(5)
+        return "summary of " + " ".join(text for _, text in turns)
+
+    backend = SqliteSessionBackend(db_path)
+    store = make_store(backend=backend, history_policy=summarizing_policy(summarizer))
+    for i in range(3):
+        # Returns while the summary is still blocked
+        turn(store, "s", f"Q{i}", f"A{i}")
+    assert len(backend.load("s")[1]) == 6
+    assert store.stats()["history_summaries"] == 0
+
+    release.set()
+    history = texts(store.get("s"))
+    assert history[0] == SUMMARY_PREFIX + "summary of Q0 A0 Q1 A1"
+    assert history[2:] == ["Q2", "A2"]
+    assert store.stats()["history_summaries"] == 1
+    assert [text for _, text in backend.load("s")[1]] == history
+
+
+def test_older_turns_are_dropped_if_the_summary_is_not_ready_in_time():
+    release = threading.Event()
+
+    def summarizer(turns):
+        release.wait(5)
+        return "too late"
+
+    store = make_store(history_policy=summarizing_policy(summarizer, summary_wait=0))
+    try:
+        for i in range(3):
+            turn(store, "s", f"Q{i}", f"A{i}")
+        assert texts(store.get("s")) == ["Q2", "A2"]
+        assert store.stats()["history_summary_fallbacks"] == 1
+    finally:
+        release.set()
+
+
+def test_older_turns_are_dropped_if_summarizing_fails():
+    def summarizer(turns):
+        raise RuntimeError("upstream down")
+
+    store = make_store(history_policy=summarizing_policy(summarizer))
+    for i in range(3):
+        turn(store, "s", f"Q{i}", f"A{i}")
+    assert texts(store.get("s")) == ["Q2", "A2"]
+    assert store.stats()["history_summary_fallbacks"] == 1